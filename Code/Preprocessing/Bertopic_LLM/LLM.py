@@ -1,118 +1,584 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-import torch
 import json
+import sys
 from tqdm import tqdm
 import os
+import hashlib
+import time
+import itertools
+import queue
+import threading
+import textwrap
+import urllib.error
+import weakref
+from verdict_cache import VerdictCache
+from comment_stream import iter_comments
+from llm_metrics import MetricsLogger
+from lexicon_classifier import LexiconCascade
+from review_length import TokenBudget, valid_verdict
+from llm_backends import load_backend
 
-#Configure 4-bit quantization
-quantization_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_compute_dtype=torch.float16,  
-    bnb_4bit_quant_type="nf4",            
-    bnb_4bit_use_double_quant=True,       
-)
-
-#Load tokenizer and 4-bit quantized Qwen3-14B
-model_name = "Qwen/Qwen3-14B"  
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(
-    model_name,
-    quantization_config=quantization_config,
-    device_map="auto",  
-
-)
-
-
-
-def analyze_sentiment(current_comment):
-    analysis_prompt = f"""
-        Analyze the electric vehicle charging station review. 
-        First determine the overall sentiment (Negative=6, Positive=7, Neutral=8) based on the review.
-        Then, provide the most relevant category (1-5 or other=9) and 1-3 key words
-        **Critical Rules**  
-    
-        category:
-        1. **Charging Functionality & Reliability** - ONLY basic functionality: Assess comments about hardware operation, faults, offline status, damage, and reliability. Keywords include but are not limited to working, works, operational, functional, broken, dead, offline, problems, issues, error, fault, neveikia, disabled, maintenance, fixed, repair, power, units. 
-        2. **Charging Performance** - Evaluate mentions of technical metrics: charging speed, power output (kW/kWh/Amps/Volts).Keywords include but are not limited to kw, kwh, amps, volts, rate, max, slow, quick, fast, charging fast, charging speed fast, 11kw, 45kw, miles, mph, top, peak.
-        3. **Location & Availability** - Judge feedback about geographical placement, discoverability, parking space availability, and obstruction issues (e.g., ICEing).Keywords include but are not limited to location, parking, spots, blocked, spaces, occupied, find, locate, access, stalls, open, convenient, easy, difficult, bay, empty, full, busy, parking, occupied.
-        4. **Pricing & Payment** - Analyze comments regarding costs, additional fees, and payment process/methods (apps, cards, etc.).Keywords include but are not limited to price, cost, expensive, cents, rate, fee, gratis, free, vend, kostenlos, charges, parking fee, too expensive, app, account, card, network, pay, activate, service.
-        5. **Environment & Service** - Evaluate surroundings (cleanliness, noise), amenities, staff service, and user comfort.Keywords include but are not limited to good, great, nice, excellent, experience, convenient, easy, simple, clean, helpful, service, friendly, quiet, amenities, environment, love, place, super, fantastic, perfect, awesome, review, satisfied. 
-        9. **Other** - Review does not belong to any of the above categories.
-        - Charging Functionality & Reliability ONLY covers basic function. Examples:  
-        - "Charges very fast" → [category] = Charging Performance  
-        - "Charger is broken" → [category] = Charging Functionality & Reliability
-
-        Key words Extraction:
-        - Key words MUST be extracted from the review AND TRANSLATED TO ENGLISH. Do not include non-English words in the final output.
-
-        Sentiment Labels:
-        - Negative (6): Explicit complaints (e.g., "环境差，充电慢" → 6,5,bad environment, slow charging).
-        - Positive (7): Explicit praise (e.g., "Worked great. It was our first time to charge our new Bolt. It was easy and intuitive."→ 7,1,Worked great,easy).
-        - Neutral (8): Objective facts (no sentiment)(e.g.,"Charging power: 50kW." → 8,2,power)
-    
-        Answer strictly according to [Overall_Sentiment],[category],[keyword].
-        Now analyze: {current_comment}
+#transformers (4-bit Qwen3-14B), cpu (small local model), stub (no model, for throughput tests)
+#or remote (client of a running llm_server.py)
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "transformers")
+#single (most relevant category per review) or aspects (sentiment of each of the five categories)
+LABEL_MODE = os.environ.get("LLM_LABEL_MODE", "single")
+MAX_BATCH_SIZE = 64
+CHECKPOINT_EVERY = 1000
+#Test runs label only the first LIMIT comments of each file; None labels all of them
+LIMIT = 300
+VERDICT_CACHE_FILE = os.path.join("Data","interim","LLM_result","verdict_cache.sqlite")
+METRICS_FILE = os.path.join("Data","interim","LLM_result","metrics.jsonl")
+#Reviews longer than this many tokens are chunked (or truncated) before labelling
+REVIEW_TOKEN_LIMIT = 256
+REVIEW_LENGTH_MODE = "chunk"
+#Retries of a batch at the same size after a connection error or timeout
+TRANSIENT_RETRIES = 3
+#Successful batches after which a reduced batch size is allowed to double again
+REGROW_AFTER = 50
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, urllib.error.URLError)
+#(review_file, output_file) per region
+REGIONS = [
+    (os.path.join("Data","input","china_comments.json"), os.path.join("Data","interim","LLM_result","china_comments.json")),
+    (os.path.join("Data","input","usa_comments.json"), os.path.join("Data","interim","LLM_result","usa_comments.json")),
+    (os.path.join("Data","input","europe_comments.json"), os.path.join("Data","interim","LLM_result","europe_comments.json")),
+]
+
+_backend = {}
+_backoff = weakref.WeakKeyDictionary()
+
+def get_backend(name=LLM_BACKEND):
+    """Load the labelling backend on first use and keep it for the rest of the run"""
+    if name not in _backend:
+        _backend[name] = load_backend(name, mode=LABEL_MODE)
+    return _backend[name]
+
+class BatchBackoff:
+    def __init__(self, limit=MAX_BATCH_SIZE):
+        """Largest batch size a backend has recently sustained, regrowing up to limit"""
+        self.limit = limit
+        self.cap = limit
+        self.successes = 0
+
+    def shrink(self, size):
+        self.cap = max(1, size // 2)
+        self.successes = 0
+
+    def succeeded(self):
+        self.successes += 1
+        if self.successes >= REGROW_AFTER and self.cap < self.limit:
+            self.cap = min(self.limit, self.cap * 2)
+            self.successes = 0
+
+def is_out_of_memory(error):
+    #torch.cuda.OutOfMemoryError, or its message relayed by the labelling server
+    return isinstance(error, MemoryError) or type(error).__name__ == "OutOfMemoryError" \
+        or "out of memory" in str(error).lower()
+
+def generate_with_retry(backend, batch_ids):
+    for attempt in range(TRANSIENT_RETRIES + 1):
+        try:
+            return backend.generate(batch_ids)
+        except TRANSIENT_ERRORS:
+            if attempt == TRANSIENT_RETRIES:
+                raise
+            time.sleep(2 ** attempt)
+
+def analyze_sentiment_batch(comments, batch_size=None, backend=None, metrics=None, budget=None, with_confidence=False):
+    """
+    Label a list of reviews in length-sorted padded batches, results in input order
+
+    A batch that runs out of memory is retried as two halves. A review that still runs out of memory
+    on its own gets None instead of a label, so the caller can set it aside. Any other error is raised.
+    With with_confidence, also return the probabilities of the sentiment and category tokens.
     """
-    messages = [
-                    {"role": "user", "content": analysis_prompt}]
-    text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True,
-        enable_thinking=False
-    )
-    
-    inputs = tokenizer(text, return_tensors="pt").to(model.device)
-    outputs = model.generate(**inputs, max_new_tokens=10)
-    
- 
-    response = tokenizer.decode(outputs[0][len(inputs.input_ids[0]):], skip_special_tokens=True)
-    return response.strip()
-
-def processing(review_file,output_file):
-    #Load dataset   
-    with open(review_file, 'r', encoding='utf-8') as input_file:
-
-        dataset = {'comment_list':json.load(input_file)['comment_list'][:300]}
-    
+    backend = backend or get_backend()
+    budget = budget and backend.review_budget(budget)
+    if budget:
+        pieces, owners = budget.split(comments, backend)
+        responses, confidences = analyze_sentiment_batch(pieces, batch_size, backend, metrics, with_confidence=True)
+        merged = budget.merge(responses, owners, len(comments)), budget.merge_confidence(confidences, owners, len(comments))
+        return merged if with_confidence else merged[0]
+    input_ids = backend.encode(comments)
+    prefix_len = backend.prefix_len()
+    order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]))
+    responses = [None] * len(input_ids)
+    confidences = [None] * len(input_ids)
+    limit = backend.batch_limit(MAX_BATCH_SIZE)
+    backoff = _backoff.setdefault(backend, BatchBackoff(limit))
+    #halves of batches that ran out of memory, each labelled (or halved again) on its own
+    halves = []
+
+    start = 0
+    while halves or start < len(order):
+        halved = bool(halves)
+        if halved:
+            batch_idx = halves.pop()
+        else:
+            #sorted ascending, so the longest prompt of a batch is its last one
+            longest = len(input_ids[order[min(start + limit, len(order)) - 1]])
+            size = min(batch_size or backend.auto_batch_size(prefix_len + longest, limit), backoff.cap)
+            batch_idx = order[start:start + size]
+            start += len(batch_idx)
+        batch_ids = [input_ids[i] for i in batch_idx]
+        batch_start = time.perf_counter()
         try:
-            progress_bar = tqdm(dataset['comment_list'], desc="Processing comments")
-            mmm = 0
-            for comment_data in progress_bar:
-                current_comment = comment_data["content"]
-                mmm+=1
-
-                sentiment = analyze_sentiment(current_comment)
-                print(current_comment)
-                print(sentiment)
-                comment_data['sentiment'] = sentiment
-            
-
-                if mmm % 1000 == 0:
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        json.dump(dataset, f, ensure_ascii=False, indent=4)
-    
+            decoded, info = generate_with_retry(backend, batch_ids)
         except Exception as e:
-            print(f"Error: {str(e)}")
+            if not is_out_of_memory(e):
+                raise
+            backend.release_memory()
+            if len(batch_ids) > 1:
+                print(f"Batch of {len(batch_ids)} ran out of memory, retrying as two halves")
+                #once per batch: bisecting down to one poison review must not leave later batches at size 1
+                if not halved:
+                    backoff.shrink(len(batch_ids))
+                middle = len(batch_idx) // 2
+                #popped first half first
+                halves.extend([batch_idx[middle:], batch_idx[:middle]])
+                continue
+            print(f"Review ran out of memory on its own, setting it aside: {str(e)[:200]}")
+            continue
+        backoff.succeeded()
+        if metrics:
+            metrics.record_batch(
+                reviews=len(batch_ids),
+                prompt_tokens=sum(len(ids) for ids in batch_ids),
+                padded_tokens=len(batch_ids) * len(batch_ids[-1]),
+                generated_tokens=info["generated_tokens"],
+                latency=time.perf_counter() - batch_start,
+                device_memory=backend.peak_memory(),
+            )
+        for i, response, confidence in zip(batch_idx, decoded, info["confidence"]):
+            responses[i] = response
+            confidences[i] = confidence
+    return (responses, confidences) if with_confidence else responses
+
+def analyze_sentiment(current_comment, backend=None):
+    return analyze_sentiment_batch([current_comment], batch_size=1, backend=backend)[0]
+
+def analyze_sentiment_cached(comments, cache, batch_size=None, backend=None, metrics=None, budget=None):
+    """Labels and confidences of reviews, running the model only on texts the verdict cache has not seen"""
+    keys = [cache.key(comment) for comment in comments]
+    verdicts = cache.get_many(set(keys))
+    todo = {}
+    for key, comment in zip(keys, comments):
+        if key not in verdicts and key not in todo:
+            todo[key] = comment
+
+    elapsed = 0.0
+    if todo:
+        start = time.perf_counter()
+        responses, confidences = analyze_sentiment_batch(list(todo.values()), batch_size, backend, metrics, budget,
+                                                         with_confidence=True)
+        elapsed = time.perf_counter() - start
+        new_verdicts = list(zip(todo, zip(responses, confidences)))
+        #reviews that failed are retried next time rather than cached
+        cache.put_many([(key, verdict) for key, verdict in new_verdicts if verdict[0] is not None])
+        verdicts.update(new_verdicts)
+    #repeats inside the chunk are served from the same inference, so they count as hits
+    cache.record(len(comments) - len(todo), len(todo), elapsed)
+    if metrics:
+        metrics.set_gauge("cache_hit_rate", round(cache.hits / (cache.hits + cache.misses), 4))
+    return [verdicts[key][0] for key in keys], [verdicts[key][1] for key in keys]
+
+def comment_key(comment_data):
+    content_hash = hashlib.sha1(comment_data["content"].encode("utf-8")).hexdigest()
+    return f"{comment_data['uid']}:{content_hash}"
+
+def shard_path(output_file, selection):
+    """Output file of the shard selected by iter_comments' shard/num_shards arguments: <name>.shard-k-of-n.json"""
+    num_shards = selection.get("num_shards", 1)
+    if num_shards == 1:
+        return output_file
+    name, ext = os.path.splitext(output_file)
+    return f"{name}.shard-{selection.get('shard', 0)}-of-{num_shards}{ext}"
+
+def journal_path(output_file):
+    return os.path.splitext(output_file)[0] + ".journal.jsonl"
+
+def failures_path(output_file):
+    return os.path.splitext(output_file)[0] + ".failures.jsonl"
+
+def load_failures(path):
+    """Keys of the comments already set aside in a failures file"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {json.loads(line)["key"] for line in f if line.strip()}
+
+def load_journal(path):
+    """Labels already written to the journal, keyed by uid and content hash"""
+    labelled = {}
+    if not os.path.exists(path):
+        return labelled
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                #a crash can leave the last line half written
+                continue
+            labelled[record["key"]] = {"sentiment": record["sentiment"], "confidence": record.get("confidence")}
+    return labelled
+
+def open_journal(path):
+    journal = open(path, 'a+', encoding='utf-8')
+    journal.seek(0, os.SEEK_END)
+    if journal.tell() > 0:
+        journal.seek(journal.tell() - 1)
+        if journal.read(1) != "\n":
+            journal.write("\n")
+    return journal
+
+def append_journal(journal, records):
+    for key, label in records:
+        journal.write(json.dumps({"key": key, **label}, ensure_ascii=False) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+def iter_region(review_file, selection):
+    """Stream the comments of one input file; selection holds iter_comments' offset/limit/shard arguments"""
+    return iter_comments(review_file, **{"limit": LIMIT, **selection})
+
+def chunked(comments, size=CHECKPOINT_EVERY):
+    comments = iter(comments)
+    while chunk := list(itertools.islice(comments, size)):
+        yield chunk
+
+def record_chunk(journal, output_file, chunk, sentiments, confidences, labelled):
+    """Journal the labelled comments of a chunk and set aside the ones that could not be labelled"""
+    records = [(comment_key(c), {"sentiment": sentiment, "confidence": confidence})
+               for c, sentiment, confidence in zip(chunk, sentiments, confidences) if sentiment is not None]
+    append_journal(journal, records)
+    labelled.update(records)
+    failed = [c for c, sentiment in zip(chunk, sentiments) if sentiment is None]
+    if failed:
+        #a comment that fails again on a later run is only listed once
+        known = load_failures(failures_path(output_file))
+        failed = {comment_key(c): c for c in failed if comment_key(c) not in known}
+        with open(failures_path(output_file), 'a', encoding='utf-8') as f:
+            for comment_data in failed.values():
+                record = {"key": comment_key(comment_data), "uid": comment_data["uid"], "content": comment_data["content"]}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def compact_journal(review_file, selection, labelled, output_file):
+    """Write the comment_list JSON read by LLM_result_processing.py from the input and the journal"""
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write('{\n    "comment_list": [')
+        for i, comment_data in enumerate(iter_region(review_file, selection)):
+            key = comment_key(comment_data)
+            if key in labelled:
+                comment_data['sentiment'] = labelled[key]["sentiment"]
+                if labelled[key]["confidence"]:
+                    comment_data['confidence'] = labelled[key]["confidence"]
+            item = json.dumps(comment_data, ensure_ascii=False, indent=4)
+            f.write(("," if i else "") + "\n" + textwrap.indent(item, " " * 8))
+        f.write("\n    ]\n}")
+    os.replace(tmp_file, output_file)
+
+def needs_label(label, requeue_below):
+    if label is None:
+        return True
+    if requeue_below is None:
+        return False
+    #labels without a recorded confidence are kept
+    return min((label["confidence"] or {}).values(), default=1.0) < requeue_below
+
+def load_region(review_file, output_file, selection, requeue_below=None):
+    """Journalled labels and a stream of the comments still to label for one input file"""
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    labelled = load_journal(journal_path(output_file))
+    print(f"{review_file}: {len(labelled)} comments already labelled")
+    pending = (c for c in iter_region(review_file, selection)
+               if needs_label(labelled.get(comment_key(c)), requeue_below))
+    return labelled, pending
+
+def label_chunk(contents, cache, batch_size, backend, metrics=None, cascade=None, budget=None):
+    """Labels and confidences for the contents of one chunk"""
+    def llm_label(texts):
+        if cache:
+            return analyze_sentiment_cached(texts, cache, batch_size, backend, metrics, budget)
+        return analyze_sentiment_batch(texts, batch_size, backend, metrics, budget, with_confidence=True)
+    if cascade:
+        return cascade.label(contents, llm_label)
+    return llm_label(contents)
+
+def processing(review_file,output_file,batch_size=None,cache_file=VERDICT_CACHE_FILE,backend=None,
+               metrics_file=METRICS_FILE,cascade_threshold=None,requeue_below=None,**selection):
+    """
+    Label one input file, journalling every chunk, and write the labelled comment_list to output_file
+
+    Parameters:
+        review_file: Input JSON with a top-level comment_list
+        output_file: Labelled output; with num_shards > 1 each shard writes <name>.shard-k-of-n.json
+            instead, with its own journal and failures file, so shards can run at the same time
+        selection: offset/limit/shard arguments of iter_comments
+    """
+    output_file = shard_path(output_file, selection)
+    labelled, pending = load_region(review_file, output_file, selection, requeue_below)
+    journal = open_journal(journal_path(output_file))
+    backend = backend or get_backend()
+    cache = VerdictCache(cache_file, backend.version()) if cache_file else None
+    metrics = MetricsLogger(metrics_file) if metrics_file else None
+    cascade = LexiconCascade(cascade_threshold) if cascade_threshold is not None else None
+    budget = TokenBudget(REVIEW_TOKEN_LIMIT, REVIEW_LENGTH_MODE) if REVIEW_TOKEN_LIMIT else None
+    try:
+        progress_bar = tqdm(desc="Processing comments")
+        for chunk in chunked(pending):
+            sentiments, confidences = label_chunk([c["content"] for c in chunk], cache, batch_size, backend,
+                                                  metrics, cascade, budget)
+            record_chunk(journal, output_file, chunk, sentiments, confidences, labelled)
+            progress_bar.update(len(chunk))
+    finally:
+        journal.close()
+        if cache:
+            print(cache.report())
+            cache.close()
+        if metrics:
+            print(metrics.summary())
+            metrics.close()
+        if cascade:
+            print(cascade.report())
+        if budget:
+            print(budget.report())
+        compact_journal(review_file, selection, labelled, output_file)
+
+def default_workers(name=LLM_BACKEND):
+    """One backend per CUDA device for the transformers backend, otherwise a single one"""
+    if name == "transformers":
+        import torch
+        if torch.cuda.device_count() > 1:
+            return [lambda device=device: load_backend(name, device_map={"": device}, mode=LABEL_MODE)
+                    for device in range(torch.cuda.device_count())]
+    return [lambda: get_backend(name)]
+
+def run_regions(regions=REGIONS, workers=None, batch_size=None, cache_file=VERDICT_CACHE_FILE,
+                metrics_file=METRICS_FILE, cascade_threshold=None, requeue_below=None, **selection):
+    """
+    Label all regions from one shared queue of chunks
+
+    Parameters:
+        regions: (review_file, output_file) pairs
+        workers: Functions that each create the backend of one worker thread
+        batch_size: Fixed generation batch size, or None to size batches from free memory
+        cache_file: Verdict cache shared by all workers, or None to disable it
+        metrics_file: JSONL file for per-batch metrics, or None to disable them
+        cascade_threshold: Lexicon confidence above which reviews skip the LLM, or None to send all to the LLM
+        requeue_below: Relabel journalled comments whose sentiment or category probability is below this,
+            typically with a stronger backend or prompt (same settings are answered by the verdict cache)
+        selection: offset/limit/shard arguments applied to every input file; with num_shards > 1 each
+            output file becomes <name>.shard-k-of-n.json (see processing)
+    """
+    workers = workers or default_workers()
+    states = []
+    for review_file, output_file in regions:
+        output_file = shard_path(output_file, selection)
+        labelled, pending = load_region(review_file, output_file, selection, requeue_below)
+        states.append({
+            "review_file": review_file,
+            "output_file": output_file,
+            "labelled": labelled,
+            "chunks": chunked(pending),
+            "journal": open_journal(journal_path(output_file)),
+            "lock": threading.Lock(),
+            "in_flight": 0,
+            "exhausted": False,
+            "done": False,
+            "failed": False,
+        })
+
+    def finish_if_complete(state):
+        #called with the region's lock held
+        if state["exhausted"] and state["in_flight"] == 0 and not state["done"]:
+            state["journal"].close()
+            compact_journal(state["review_file"], selection, state["labelled"], state["output_file"])
+            state["done"] = True
+
+    #A bounded queue keeps only a few chunks per worker in memory
+    work = queue.Queue(maxsize=2 * len(workers))
+    progress_bar = tqdm(desc="Processing comments")
+    metrics = MetricsLogger(metrics_file) if metrics_file else None
+    budget = TokenBudget(REVIEW_TOKEN_LIMIT, REVIEW_LENGTH_MODE) if REVIEW_TOKEN_LIMIT else None
+
+    #Exceptions that stop the producer or a worker, raised again in the calling thread
+    errors = []
+
+    def produce():
+        #Interleave the regions so each one keeps moving, whichever is largest
+        active = list(states)
+        state = None
+        try:
+            while active:
+                for state in list(active):
+                    chunk = next(state["chunks"], None)
+                    with state["lock"]:
+                        if chunk is None:
+                            state["exhausted"] = True
+                            finish_if_complete(state)
+                            active.remove(state)
+                            continue
+                        state["in_flight"] += 1
+                    work.put((state, chunk))
+        except Exception as e:
+            #a missing or malformed input file; its output is left as it was
+            if state is not None:
+                state["failed"] = True
+            errors.append(e)
         finally:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(dataset, f, ensure_ascii=False, indent=4)
+            #the workers stop on these whatever happened, so none waits for work forever
+            for _ in workers:
+                work.put(None)
+
+    def worker(make_backend):
+        cache = cascade = None
+        try:
+            backend = make_backend()
+            cache = VerdictCache(cache_file, backend.version()) if cache_file else None
+            cascade = LexiconCascade(cascade_threshold) if cascade_threshold is not None else None
+            while (item := work.get()) is not None:
+                state, chunk = item
+                if metrics:
+                    metrics.set_gauge("queue_depth", work.qsize())
+                try:
+                    labels = label_chunk([c["content"] for c in chunk], cache, batch_size, backend, metrics, cascade, budget)
+                except Exception as e:
+                    print(f"Error in {state['output_file']}: {str(e)}, {len(chunk)} comments left for the next run")
+                    labels = None
+                with state["lock"]:
+                    if labels is not None:
+                        record_chunk(state["journal"], state["output_file"], chunk, *labels, state["labelled"])
+                    state["in_flight"] -= 1
+                    #a region is written out as soon as its own last chunk is done
+                    finish_if_complete(state)
+                progress_bar.update(len(chunk))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if cache:
+                print(cache.report())
+                cache.close()
+            if cascade:
+                print(cascade.report())
+
+    threads = [threading.Thread(target=worker, args=(make_backend,)) for make_backend in workers]
+    producer = threading.Thread(target=produce, daemon=True)
+    try:
+        for thread in threads:
+            thread.start()
+        producer.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if metrics:
+            print(metrics.summary())
+            metrics.close()
+        if budget:
+            print(budget.report())
+        for state in states:
+            with state["lock"]:
+                if not state["done"]:
+                    state["journal"].close()
+                    if not state["failed"]:
+                        compact_journal(state["review_file"], selection, state["labelled"], state["output_file"])
+                    state["done"] = True
+    if errors:
+        raise errors[0]
+
+def load_manifest(manifest_file):
+    """Re-label manifest written by LLM_result_processing.py: review keys grouped by the file holding them"""
+    keys = {}
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                keys.setdefault(entry["file"], set()).add(entry["key"])
+    return keys
+
+def patch_output(output_file, patched):
+    """Rewrite output_file with the labels in patched, keyed by comment_key, leaving every other comment as is"""
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write('{\n    "comment_list": [')
+        for i, comment_data in enumerate(iter_comments(output_file)):
+            key = comment_key(comment_data)
+            if key in patched:
+                comment_data['sentiment'] = patched[key]["sentiment"]
+                comment_data.pop('confidence', None)
+                if patched[key]["confidence"]:
+                    comment_data['confidence'] = patched[key]["confidence"]
+            item = json.dumps(comment_data, ensure_ascii=False, indent=4)
+            f.write(("," if i else "") + "\n" + textwrap.indent(item, " " * 8))
+        f.write("\n    ]\n}")
+    os.replace(tmp_file, output_file)
+
+def region_outputs(keys, regions=REGIONS):
+    """Output file of the region whose journal holds each of keys; keys no journal holds are left out"""
+    owners = {}
+    for _, output_file in regions:
+        labelled = load_journal(journal_path(output_file))
+        owners.update((key, output_file) for key in keys if key in labelled and key not in owners)
+    return owners
+
+def relabel(manifest_file, batch_size=None, cache_file=VERDICT_CACHE_FILE, backend=None, metrics_file=METRICS_FILE,
+            regions=REGIONS):
+    """
+    Label again only the reviews listed in a re-label manifest and patch the files holding them in place
+
+    The verdict cache is bypassed, since it would return the same unusable answer; new answers that
+    are well formed replace it there. They are also appended to the journal of the region that labelled
+    the review and patched into its output, so later compactions of that region keep them.
+    """
+    backend = backend or get_backend()
+    cache = VerdictCache(cache_file, backend.version()) if cache_file else None
+    metrics = MetricsLogger(metrics_file) if metrics_file else None
+    budget = TokenBudget(REVIEW_TOKEN_LIMIT, REVIEW_LENGTH_MODE) if REVIEW_TOKEN_LIMIT else None
+    try:
+        for output_file, keys in load_manifest(manifest_file).items():
+            #the processing script writes Windows-style paths
+            output_file = os.path.normpath(output_file.replace("\\", os.sep))
+            patched = {}
+            selected = (c for c in iter_comments(output_file) if comment_key(c) in keys)
+            for chunk in chunked(selected):
+                contents = [c["content"] for c in chunk]
+                responses, confidences = analyze_sentiment_batch(contents, batch_size, backend, metrics, budget,
+                                                                 with_confidence=True)
+                for c, response, confidence in zip(chunk, responses, confidences):
+                    if valid_verdict(response):
+                        patched[comment_key(c)] = {"sentiment": response, "confidence": confidence}
+                if cache:
+                    cache.put_many([(cache.key(content), (response, confidence))
+                                    for content, response, confidence in zip(contents, responses, confidences)
+                                    if valid_verdict(response)])
+            #the manifest lists copies of the LLM.py outputs; the labels live in the regions' journals
+            owners = region_outputs(patched, regions)
+            for region_output in set(owners.values()):
+                records = {key: label for key, label in patched.items() if owners[key] == region_output}
+                with open_journal(journal_path(region_output)) as journal:
+                    append_journal(journal, records.items())
+                if os.path.exists(region_output) and os.path.abspath(region_output) != os.path.abspath(output_file):
+                    patch_output(region_output, records)
+            if patched:
+                patch_output(output_file, patched)
+            print(f"{output_file}: {len(patched)}/{len(keys)} reviews re-labelled, "
+                  f"{len(keys) - len(patched)} still unusable or not found")
+            if len(owners) < len(patched):
+                print(f"  {len(patched) - len(owners)} re-labelled reviews are in no region journal, "
+                      f"so only {output_file} holds their new label")
+    finally:
+        if cache:
+            cache.close()
+        if metrics:
+            print(metrics.summary())
+            metrics.close()
 
 def main():
-    #china
-    review_file = os.path.join("Data","input","china_comments.json")
-    output_file = os.path.join("Data","interim","LLM_result","china_comments.json")
-    processing(review_file,output_file)
-    
-    #usa
-    review_file = os.path.join("Data","input","usa_comments.json")
-    output_file = os.path.join("Data","interim","LLM_result","usa_comments.json")
-    processing(review_file,output_file)
-    
-    #europe
-    review_file = os.path.join("Data","input","europe_comments.json")
-    output_file = os.path.join("Data","interim","LLM_result","europe_comments.json")
-    processing(review_file,output_file)
+    #python LLM.py --relabel <manifest.relabel.jsonl> ... labels only the reviews listed in the manifests
+    if sys.argv[1:2] == ["--relabel"]:
+        for manifest_file in sys.argv[2:]:
+            relabel(manifest_file)
+    else:
+        run_regions()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,47 @@
+import json
+import os
+import time
+import statistics
+
+from LLM import analyze_sentiment, get_backend
+
+sample_file = os.path.join("Data", "Input", "Sample data input", "sample_data.json")
+n_reviews = 50
+
+def time_per_review(backend, comments, use_prefix_cache):
+    backend.use_prefix_cache = use_prefix_cache
+    latencies = []
+    responses = []
+    for comment in comments:
+        backend.sync()
+        start = time.perf_counter()
+        responses.append(analyze_sentiment(comment, backend))
+        backend.sync()
+        latencies.append(time.perf_counter() - start)
+    return latencies, responses
+
+def main():
+    with open(sample_file, 'r', encoding='utf-8') as f:
+        comments = [c["content"] for c in json.load(f)["comment_list"][:n_reviews]]
+
+    backend = get_backend("transformers")
+    #Build the prefix cache and warm up kernels outside of the timed runs
+    for use_prefix_cache in [True, False]:
+        backend.use_prefix_cache = use_prefix_cache
+        analyze_sentiment(comments[0], backend)
+
+    results = {}
+    for label, use_prefix_cache in [("full prompt", False), ("cached prefix", True)]:
+        results[label] = time_per_review(backend, comments, use_prefix_cache)
+
+    print(f"Reviews: {len(comments)}, prefix tokens: {backend.prefix_len()}")
+    for label, (latencies, _) in results.items():
+        print(f"{label:>14}: mean {statistics.mean(latencies) * 1000:.1f} ms, "
+              f"median {statistics.median(latencies) * 1000:.1f} ms, "
+              f"max {max(latencies) * 1000:.1f} ms per review")
+    speedup = statistics.mean(results["full prompt"][0]) / statistics.mean(results["cached prefix"][0])
+    same = sum(a == b for a, b in zip(results["full prompt"][1], results["cached prefix"][1]))
+    print(f"Speedup: {speedup:.2f}x, identical responses: {same}/{len(comments)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import json
+import os
+import sys
+import time
+
+from LLM import analyze_sentiment_batch
+from llm_backends import load_backend
+from prompts import PROMPT_VARIANTS
+from review_length import parse_verdict, ASPECTS_PATTERN
+
+sample_file = os.path.join("Data", "Input", "Sample data input", "sample_data.json")
+n_reviews = 200
+#Fields of the reference "sentiment" dicts, in category order 1-5, then the overall one
+DIMENSIONS = ["Charging Functionality and Reliability", "Charging Performance", "Location and Availability",
+              "Pricing and Payment", "Environment and Service Experience"]
+SENTIMENTS = {"6": "Negative", "7": "Positive", "8": "Neutral", "0": "null"}
+
+def to_dimensions(response):
+    """Reference-style sentiment dict of one answer, or None when it does not parse"""
+    verdict = parse_verdict(response)
+    if not verdict:
+        return None
+    sentiment, category, _ = verdict
+    labels = dict.fromkeys(DIMENSIONS, "null")
+    if ASPECTS_PATTERN.fullmatch(category):
+        labels.update((name, SENTIMENTS[digit]) for name, digit in zip(DIMENSIONS, category))
+    elif category in ("1", "2", "3", "4", "5"):
+        labels[DIMENSIONS[int(category) - 1]] = SENTIMENTS[sentiment]
+    elif category != "9":
+        return None
+    labels["Overall sentiment"] = SENTIMENTS[sentiment]
+    return labels
+
+def score(responses, references):
+    """(parse failures, overall sentiment agreement, agreement over all six dimensions) as fractions"""
+    parsed = [to_dimensions(response) for response in responses]
+    ok = [(labels, reference) for labels, reference in zip(parsed, references) if labels]
+    overall = sum(labels["Overall sentiment"] == reference["Overall sentiment"] for labels, reference in ok)
+    dimensions = sum(labels[name] == reference.get(name, "null")
+                     for labels, reference in ok for name in DIMENSIONS + ["Overall sentiment"])
+    n = len(responses)
+    return (n - len(ok)) / n, overall / n, dimensions / (n * (len(DIMENSIONS) + 1))
+
+def run_variant(backend, name, comments, references):
+    mode, prompt = PROMPT_VARIANTS[name]
+    backend.use_prompt(prompt, mode)
+    #warm up kernels and the prefix cache of this prompt outside of the timed run
+    analyze_sentiment_batch(comments[:1], backend=backend)
+    backend.sync()
+    start = time.perf_counter()
+    responses = analyze_sentiment_batch(comments, backend=backend)
+    backend.sync()
+    latency = (time.perf_counter() - start) / len(comments)
+    return (backend.instruction_tokens(), latency) + score(responses, references)
+
+def main(backend_name="transformers", variants=None):
+    with open(sample_file, 'r', encoding='utf-8') as f:
+        sample = [c for c in json.load(f)["comment_list"][:n_reviews] if isinstance(c.get("sentiment"), dict)]
+    comments = [c["content"] for c in sample]
+    references = [c["sentiment"] for c in sample]
+
+    backend = load_backend(backend_name)
+    print(f"Reviews: {len(comments)} from {sample_file}, backend: {backend.model_name}")
+    print(f"{'variant':>10} {'prompt tokens':>14} {'ms/review':>10} {'parse fail':>11} {'overall':>8} {'all dims':>9}")
+    for name in variants or PROMPT_VARIANTS:
+        tokens, latency, failures, overall, dimensions = run_variant(backend, name, comments, references)
+        print(f"{name:>10} {tokens:>14} {latency * 1000:>10.1f} {failures:>11.1%} {overall:>8.1%} {dimensions:>9.1%}")
+
+if __name__ == "__main__":
+    #python benchmark_prompts.py [backend] [variant ...]
+    main(*sys.argv[1:2], variants=sys.argv[2:] or None)
@@ -0,0 +1,53 @@
+import json
+import os
+import statistics
+import sys
+import time
+
+from LLM import analyze_sentiment_batch
+from llm_backends import load_backend
+
+sample_file = os.path.join("Data", "Input", "Sample data input", "sample_data.json")
+n_reviews = 50
+draft_model = "Qwen/Qwen3-0.6B"
+
+def time_per_review(backend, comments, speculative, batch_size):
+    backend.speculative = speculative
+    latencies = []
+    responses = []
+    for start in range(0, len(comments), batch_size):
+        batch = comments[start:start + batch_size]
+        backend.sync()
+        batch_start = time.perf_counter()
+        responses.extend(analyze_sentiment_batch(batch, batch_size, backend))
+        backend.sync()
+        latencies.extend([(time.perf_counter() - batch_start) / len(batch)] * len(batch))
+    return latencies, responses
+
+def main(draft=draft_model):
+    with open(sample_file, 'r', encoding='utf-8') as f:
+        comments = [c["content"] for c in json.load(f)["comment_list"][:n_reviews]]
+
+    backend = load_backend("transformers", draft_model=draft)
+    #Build the prefix cache and warm up both models outside of the timed runs
+    for speculative in [False, True]:
+        backend.speculative = speculative
+        analyze_sentiment_batch(comments[:1], 1, backend)
+
+    #speculative decoding runs one review at a time, so it is compared with plain decoding at batch size 1
+    #and, for the throughput trade-off, with plain batched decoding
+    runs = [("plain, batched", False, len(comments)), ("plain, 1 review", False, 1), ("speculative", True, 1)]
+    results = {label: time_per_review(backend, comments, speculative, batch_size)
+               for label, speculative, batch_size in runs}
+
+    print(f"Reviews: {len(comments)}, draft model: {draft}")
+    for label, (latencies, _) in results.items():
+        print(f"{label:>16}: mean {statistics.mean(latencies) * 1000:.1f} ms, "
+              f"median {statistics.median(latencies) * 1000:.1f} ms per review")
+    speedup = statistics.mean(results["plain, 1 review"][0]) / statistics.mean(results["speculative"][0])
+    same = sum(a == b for a, b in zip(results["plain, 1 review"][1], results["speculative"][1]))
+    print(f"Speculative vs plain at batch size 1: {speedup:.2f}x, identical responses: {same}/{len(comments)}")
+
+if __name__ == "__main__":
+    #python benchmark_speculative.py [draft model]
+    main(*sys.argv[1:2])
@@ -0,0 +1,43 @@
+import json
+import os
+import time
+import tempfile
+
+from LLM import processing
+from llm_backends import load_backend
+
+sample_file = os.path.join("Data", "Input", "Sample data input", "sample_data.json")
+n_reviews = 300
+backend_name = os.environ.get("LLM_BACKEND", "stub")
+
+def synthetic_input(path, n):
+    """Sample reviews repeated with distinct suffixes, so the verdict cache does not hide the model"""
+    with open(sample_file, 'r', encoding='utf-8') as f:
+        sample = json.load(f)["comment_list"]
+    comment_list = []
+    for i in range(n):
+        comment = dict(sample[i % len(sample)])
+        comment["content"] = f"{comment['content']} #{i}"
+        comment.pop("sentiment", None)
+        comment.pop("keywords", None)
+        comment_list.append(comment)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"comment_list": comment_list}, f, ensure_ascii=False)
+
+def main():
+    backend = load_backend(backend_name)
+    with tempfile.TemporaryDirectory() as tmp:
+        review_file = os.path.join(tmp, "comments.json")
+        output_file = os.path.join(tmp, "LLM_result", "comments.json")
+        synthetic_input(review_file, n_reviews)
+
+        start = time.perf_counter()
+        processing(review_file, output_file, cache_file=os.path.join(tmp, "verdict_cache.sqlite"),
+                   backend=backend, metrics_file=os.path.join(tmp, "metrics.jsonl"), limit=n_reviews)
+        elapsed = time.perf_counter() - start
+
+    print(f"Backend: {backend_name}, reviews: {n_reviews}, "
+          f"wall time {elapsed:.2f} s, {n_reviews / elapsed:.1f} reviews/s")
+
+if __name__ == "__main__":
+    main()
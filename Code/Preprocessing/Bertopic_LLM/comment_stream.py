@@ -0,0 +1,106 @@
+import json
+import zlib
+
+READ_SIZE = 1 << 20
+WHITESPACE = " \t\n\r"
+
+class JSONStream:
+    def __init__(self, f):
+        """Incremental reader of JSON values from a text file, holding one read buffer at a time"""
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        chunk = self.f.read(READ_SIZE)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self):
+        """Next non-whitespace character, or "" at end of file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of the read buffer")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                #the value runs past the buffer; numbers may also end exactly at its edge
+                if not self.fill():
+                    raise
+                continue
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+def stream_array(path, key="comment_list"):
+    """Yield the items of the top-level array `key` one at a time"""
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = JSONStream(f)
+        stream.expect("{")
+        while stream.peek() != "}":
+            name = stream.value()
+            stream.expect(":")
+            if name != key:
+                stream.value()
+            else:
+                stream.expect("[")
+                while stream.peek() != "]":
+                    yield stream.value()
+                    if stream.peek() == ",":
+                        stream.pos += 1
+                stream.pos += 1
+                return
+            if stream.peek() == ",":
+                stream.pos += 1
+        raise KeyError(f"{path} has no {key!r} array")
+
+def in_shard(index, comment, shard, num_shards, shard_by):
+    if num_shards == 1:
+        return True
+    if shard_by == "uid":
+        return zlib.crc32(str(comment["uid"]).encode("utf-8")) % num_shards == shard
+    return index % num_shards == shard
+
+def iter_comments(path, offset=0, limit=None, shard=0, num_shards=1, shard_by="index"):
+    """
+    Stream comment_list items of a review file
+
+    Parameters:
+        path: JSON file with a top-level comment_list
+        offset: Number of comments of this shard to skip
+        limit: Maximum number of comments to yield, None for all
+        shard: Index of this shard, 0 <= shard < num_shards
+        num_shards: Number of shards the file is split into; LLM.py labels each into its own
+            <name>.shard-k-of-n.json output and journal
+        shard_by: "index" (position in the file) or "uid" (hash of the station uid, keeps a station together)
+    """
+    if shard_by not in ("index", "uid"):
+        raise ValueError(f"shard_by must be 'index' or 'uid', not {shard_by!r}")
+    taken = 0
+    seen = 0
+    for index, comment in enumerate(stream_array(path)):
+        if not in_shard(index, comment, shard, num_shards, shard_by):
+            continue
+        seen += 1
+        if seen <= offset:
+            continue
+        if limit is not None and taken >= limit:
+            return
+        taken += 1
+        yield comment
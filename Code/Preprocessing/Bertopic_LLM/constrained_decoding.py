@@ -0,0 +1,102 @@
+import torch
+from transformers import LogitsProcessor
+
+SENTIMENT_LABELS = ["6", "7", "8"]
+CATEGORY_LABELS = ["1", "2", "3", "4", "5", "9"]
+#per-category digit of the aspects mode, 0 when the category is not mentioned
+ASPECT_LABELS = ["0", "6", "7", "8"]
+ASPECT_COUNT = 5
+MAX_KEYWORDS = 3
+
+_vocab = {}
+
+def single_token_ids(tokenizer, texts):
+    ids = []
+    for text in texts:
+        token_ids = tokenizer.encode(text, add_special_tokens=False)
+        if len(token_ids) != 1:
+            raise ValueError(f"{text!r} is not a single token for this tokenizer")
+        ids.append(token_ids[0])
+    return ids
+
+def answer_vocab(tokenizer):
+    """Token ids of the label digits, separators and line breaks of an answer"""
+    if not _vocab:
+        pieces = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+        _vocab.update(
+            sentiment=torch.tensor(single_token_ids(tokenizer, SENTIMENT_LABELS)),
+            category=torch.tensor(single_token_ids(tokenizer, CATEGORY_LABELS)),
+            aspect=torch.tensor(single_token_ids(tokenizer, ASPECT_LABELS)),
+            comma=torch.tensor(single_token_ids(tokenizer, [","])),
+            #the answer is one line, and the keyword list ends after MAX_KEYWORDS
+            newline=torch.tensor([i for i, piece in enumerate(pieces) if "\n" in piece or "\r" in piece]),
+            any_comma=torch.tensor([i for i, piece in enumerate(pieces) if "," in piece or "，" in piece]),
+        )
+    return _vocab
+
+def answer_head(mode):
+    """(vocab entry, confidence name) per token before the keywords, for "single" or "aspects" answers"""
+    if mode == "aspects":
+        #"[6-8],[0/6-8 for each of categories 1-5],"
+        return ([("sentiment", "sentiment"), ("comma", None)]
+                + [("aspect", f"aspect{i}") for i in range(1, ASPECT_COUNT + 1)] + [("comma", None)])
+    #"[6-8],[1-5 or 9],"
+    return [("sentiment", "sentiment"), ("comma", None), ("category", "category"), ("comma", None)]
+
+class AnswerFormatProcessor(LogitsProcessor):
+    def __init__(self, tokenizer, prompt_len, mode="single"):
+        """
+        Restrict generation to "[6-8],[1-5 or 9],[keywords]", or "[6-8],[five 0/6-8 digits],[keywords]" in aspects mode
+
+        Parameters:
+            tokenizer: Tokenizer of the labelling model
+            prompt_len: Padded prompt length of the batch, where the answer starts
+            mode: "single" or "aspects"
+        """
+        self.prompt_len = prompt_len
+        vocab = answer_vocab(tokenizer)
+        self.head = [vocab[name] for name, _ in answer_head(mode)]
+        self.newline = vocab["newline"]
+        self.any_comma = vocab["any_comma"]
+
+    def __call__(self, input_ids, scores):
+        step = input_ids.shape[1] - self.prompt_len
+        if step < len(self.head):
+            allowed = self.head[step].to(scores.device)
+            masked = torch.full_like(scores, float("-inf"))
+            masked[:, allowed] = scores[:, allowed]
+            return masked
+
+        scores[:, self.newline.to(scores.device)] = float("-inf")
+        keywords = input_ids[:, self.prompt_len + len(self.head):]
+        any_comma = self.any_comma.to(scores.device)
+        separators = torch.isin(keywords, any_comma).sum(dim=1)
+        full = separators >= MAX_KEYWORDS - 1
+        if full.any():
+            rows = full.nonzero(as_tuple=True)[0]
+            scores[rows.unsqueeze(1), any_comma.unsqueeze(0)] = float("-inf")
+        return scores
+
+def label_confidence(tokenizer, logits, generated, mode="single"):
+    """
+    Probability of each generated label token among the valid labels
+
+    Parameters:
+        tokenizer: Tokenizer of the labelling model
+        logits: Raw per-step logits returned by generate(output_logits=True)
+        generated: Generated token ids, batch x steps
+        mode: "single" or "aspects"
+    """
+    vocab = answer_vocab(tokenizer)
+    confidences = [{} for _ in range(generated.shape[0])]
+    for step, (entry, name) in enumerate(answer_head(mode)):
+        if name is None or step >= len(logits):
+            continue
+        ids = vocab[entry].to(logits[step].device)
+        probs = torch.softmax(logits[step][:, ids].float(), dim=-1)
+        chosen = generated[:, step].unsqueeze(1).to(ids.device) == ids.unsqueeze(0)
+        picked = (probs * chosen).sum(dim=1)
+        for row, confidence in enumerate(confidences):
+            if chosen[row].any():
+                confidence[name] = round(float(picked[row]), 4)
+    return [confidence or None for confidence in confidences]
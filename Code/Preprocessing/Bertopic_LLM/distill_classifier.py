@@ -0,0 +1,162 @@
+import os
+import time
+from collections import Counter
+
+import joblib
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from tqdm import tqdm
+
+from comment_stream import iter_comments
+from embeddings import EMBEDDING_MODEL, EmbeddingStore
+from LLM import REGIONS, chunked, comment_key, compact_journal, journal_path, load_journal
+from review_length import parse_verdict
+from text_preprocessing import preprocess_parallel
+
+DISTILLED_MODEL_FILE = os.path.join("Data","interim","LLM_result","distilled_classifier.joblib")
+DISTILLED_DIR = os.path.join("Data","interim","LLM_result","distilled")
+#Fraction of the LLM labels kept out of training to measure agreement
+HELD_OUT = 0.2
+#Confidence above which the report also gives coverage and accuracy separately
+CONFIDENT = 0.9
+#Reviews preprocessed and labelled per step; large enough to keep the preprocessing pool busy
+LABEL_CHUNK = 100_000
+
+def load_llm_labels(output_files):
+    """(content, sentiment, category) of every parsed single-category LLM answer in output_files"""
+    rows = []
+    for output_file in output_files:
+        if not os.path.exists(output_file):
+            continue
+        for comment in iter_comments(output_file):
+            verdict = parse_verdict(comment.get("sentiment"))
+            #aspects-mode answers and unparseable ones carry no single category to learn
+            if verdict and verdict[1] in ("1", "2", "3", "4", "5", "9"):
+                rows.append((comment["content"], verdict[0], verdict[1]))
+    return rows
+
+def review_embeddings(contents, store):
+    """
+    Embeddings of the preprocessed text of contents, the text BERTopic embeds
+
+    Texts a BERTopic run (or an earlier labelling run) already embedded come from the embedding store,
+    so only new texts go through the sentence model. Reviews left empty by preprocessing are embedded as is.
+    """
+    processed = preprocess_parallel(contents)
+    return store.embed([text or content for text, content in zip(processed, contents)])
+
+class DistilledClassifier:
+    def __init__(self, C=1.0, max_iter=1000):
+        """
+        Sentiment and category of a review predicted from its sentence embedding
+
+        Parameters:
+            C: Inverse regularization strength of the two logistic regressions
+            max_iter: Solver iterations
+        """
+        self.embedding_model = EMBEDDING_MODEL
+        self.sentiment = LogisticRegression(C=C, max_iter=max_iter)
+        self.category = LogisticRegression(C=C, max_iter=max_iter)
+
+    def fit(self, embeddings, sentiments, categories):
+        self.sentiment.fit(embeddings, sentiments)
+        self.category.fit(embeddings, categories)
+        return self
+
+    def predict(self, embeddings):
+        """"[sentiment],[category]" answers and their confidences, one per embedding row"""
+        results = []
+        for model in (self.sentiment, self.category):
+            probs = model.predict_proba(embeddings)
+            best = probs.argmax(axis=1)
+            results.append((model.classes_[best], probs[np.arange(len(best)), best]))
+        (sentiments, sentiment_probs), (categories, category_probs) = results
+        labels = [f"{s},{c}" for s, c in zip(sentiments, categories)]
+        confidences = [{"distilled_sentiment": round(float(p), 4), "distilled_category": round(float(q), 4)}
+                       for p, q in zip(sentiment_probs, category_probs)]
+        return labels, confidences
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        #the estimators only: a pickled DistilledClassifier would only load from the module it was saved from
+        joblib.dump({"embedding_model": self.embedding_model, "sentiment": self.sentiment, "category": self.category}, path)
+
+    @staticmethod
+    def load(path):
+        saved = joblib.load(path)
+        classifier = DistilledClassifier()
+        classifier.embedding_model = saved["embedding_model"]
+        classifier.sentiment = saved["sentiment"]
+        classifier.category = saved["category"]
+        return classifier
+
+def accuracy_report(classifier, embeddings, sentiments, categories):
+    labels, confidences = classifier.predict(embeddings)
+    predicted = [label.split(",") for label in labels]
+    sentiment_ok = np.array([p[0] == s for p, s in zip(predicted, sentiments)])
+    both_ok = sentiment_ok & np.array([p[1] == c for p, c in zip(predicted, categories)])
+    confident = np.array([min(c.values()) >= CONFIDENT for c in confidences])
+    lines = [f"Held-out agreement with the LLM on {len(labels)} reviews: sentiment {sentiment_ok.mean():.1%}, "
+             f"sentiment and category {both_ok.mean():.1%}"]
+    if confident.any():
+        lines.append(f"  confidence >= {CONFIDENT}: {confident.mean():.1%} of reviews, "
+                     f"sentiment {sentiment_ok[confident].mean():.1%}, sentiment and category {both_ok[confident].mean():.1%}")
+    for name, truth, ok in [("sentiment", sentiments, sentiment_ok), ("category", categories, both_ok)]:
+        counts = Counter(truth)
+        per_class = ", ".join(f"{label}: {np.mean([o for o, t in zip(ok, truth) if t == label]):.0%} of {counts[label]}"
+                              for label in sorted(counts))
+        lines.append(f"  {name} classes ({'correct' if name == 'sentiment' else 'both correct'}): {per_class}")
+    return "\n".join(lines)
+
+def distill(output_files=None, model_file=DISTILLED_MODEL_FILE, seed=0):
+    """Train on the LLM labels of output_files, print the held-out report and save the classifier"""
+    output_files = output_files or [output_file for _, output_file in REGIONS]
+    rows = load_llm_labels(output_files)
+    if len(rows) < 10:
+        raise ValueError(f"Only {len(rows)} parsed LLM labels in {output_files}, too few to distill")
+    contents, sentiments, categories = map(list, zip(*rows))
+    store = EmbeddingStore(model_name=EMBEDDING_MODEL)
+    embeddings = review_embeddings(contents, store)
+    store.close()
+
+    order = np.random.default_rng(seed).permutation(len(rows))
+    n_test = max(1, int(len(rows) * HELD_OUT))
+    test, train = order[:n_test], order[n_test:]
+    pick = lambda values, idx: [values[i] for i in idx]
+    classifier = DistilledClassifier().fit(embeddings[train], pick(sentiments, train), pick(categories, train))
+    print(accuracy_report(classifier, embeddings[test], pick(sentiments, test), pick(categories, test)))
+    classifier.save(model_file)
+    return classifier
+
+def label_region(review_file, output_file, classifier, distilled_file, chunk_size=LABEL_CHUNK):
+    """
+    Label every review of review_file, keeping the LLM label wherever the journal of output_file has one
+
+    The result has the comment_list layout of the LLM output, so LLM_result_processing.py reads it as is.
+    """
+    labelled = load_journal(journal_path(output_file))
+    store = EmbeddingStore(model_name=classifier.embedding_model)
+    start = time.perf_counter()
+    distilled = 0
+    for chunk in tqdm(chunked(iter_comments(review_file), chunk_size), desc=f"Distilled labels {os.path.basename(review_file)}"):
+        chunk = [c for c in chunk if comment_key(c) not in labelled]
+        if not chunk:
+            continue
+        labels, confidences = classifier.predict(review_embeddings([c["content"] for c in chunk], store))
+        labelled.update((comment_key(c), {"sentiment": label, "confidence": confidence})
+                        for c, label, confidence in zip(chunk, labels, confidences))
+        distilled += len(chunk)
+    store.close()
+    seconds = time.perf_counter() - start
+    print(f"{review_file}: {distilled} reviews labelled by the classifier "
+          f"({distilled / seconds if seconds else 0:.0f} reviews/s)")
+    os.makedirs(os.path.dirname(distilled_file), exist_ok=True)
+    compact_journal(review_file, {"limit": None}, labelled, distilled_file)
+
+def main():
+    classifier = distill()
+    for review_file, output_file in REGIONS:
+        label_region(review_file, output_file, classifier, os.path.join(DISTILLED_DIR, os.path.basename(output_file)))
+
+if __name__ == "__main__":
+    main()
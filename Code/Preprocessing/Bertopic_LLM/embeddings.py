@@ -0,0 +1,93 @@
+import os
+import re
+
+from sqlite_store import AppendOnlyStore, select_in, text_hash
+
+EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+EMBED_BATCH_SIZE = 256
+EMBEDDING_STORE_DIR = os.path.join("processing_output","embedding_cache")
+#Texts embedded and appended to the store per step
+STORE_CHUNK = 50_000
+
+_models = {}
+
+def load_embedding_model(model_name=EMBEDDING_MODEL, device=None):
+    """The sentence embedding model used by BERTopic, loaded once per process"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    if (model_name, device) not in _models:
+        _models[model_name, device] = SentenceTransformer(model_name, device=device)
+    return _models[model_name, device]
+
+def embed(texts, model=None, batch_size=EMBED_BATCH_SIZE, show_progress_bar=False):
+    """float32 embeddings of texts, one row per text"""
+    model = model or load_embedding_model()
+    return model.encode(list(texts), batch_size=batch_size, show_progress_bar=show_progress_bar,
+                        convert_to_numpy=True)
+
+class EmbeddingStore(AppendOnlyStore):
+    def __init__(self, directory=EMBEDDING_STORE_DIR, model_name=EMBEDDING_MODEL):
+        """
+        Embeddings of texts in an append-only float32 matrix, memory-mapped for reading
+
+        Parameters:
+            directory: Root of the store; each embedding model gets its own subdirectory
+            model_name: Sentence embedding model the vectors come from
+        """
+        self.model_name = model_name
+        #text hash -> row in vectors.bin
+        super().__init__(os.path.join(directory, re.sub(r"[^\w.-]", "_", model_name)), "vectors.bin", "float32",
+                         ["CREATE TABLE IF NOT EXISTS texts (text_hash TEXT PRIMARY KEY, row INTEGER)",
+                          "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"])
+
+    @property
+    def dim(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        return row[0] if row else None
+
+    def indexed_size(self):
+        rows = self.conn.execute("SELECT MAX(row) + 1 FROM texts").fetchone()[0]
+        return (rows or 0) * (self.dim or 0)
+
+    def rows(self, keys):
+        return dict(select_in(self.conn, "SELECT text_hash, row FROM texts WHERE text_hash IN ({})", keys))
+
+    def append(self, keys, vectors):
+        vectors = self.np.asarray(vectors, dtype=self.np.float32)
+        dim = self.dim
+        if dim is None:
+            dim = vectors.shape[1]
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (dim,))
+        first = self.write(vectors) // dim
+        #the index only points at vectors that are already on disk
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO texts VALUES (?, ?)",
+                                  [(key, first + i) for i, key in enumerate(keys)])
+
+    def embed(self, texts, model=None, batch_size=EMBED_BATCH_SIZE):
+        """Embeddings of texts in order, computing only the texts the store has not seen"""
+        keys = [text_hash(text) for text in texts]
+        with self.lock:
+            found = self.rows(keys)
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found:
+                    missing.setdefault(key, text)
+            print(f"Embedding store: {sum(key in found for key in keys)}/{len(keys)} texts cached, "
+                  f"embedding {len(missing)} new")
+            new_keys = list(missing)
+            for start in range(0, len(new_keys), STORE_CHUNK):
+                chunk = new_keys[start:start + STORE_CHUNK]
+                vectors = embed([missing[key] for key in chunk], model or load_embedding_model(self.model_name),
+                                batch_size, show_progress_bar=True)
+                self.append(chunk, vectors)
+            found = self.rows(keys)
+            if not keys:
+                return self.np.zeros((0, self.dim or 0), dtype=self.np.float32)
+            rows = [found[key] for key in keys]
+            dim = self.dim
+            vectors = self.mapped((max(rows) + 1) * dim)
+            return self.np.asarray(vectors[:len(vectors) // dim * dim].reshape(-1, dim)[rows])
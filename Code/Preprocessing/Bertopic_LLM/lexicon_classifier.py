@@ -0,0 +1,172 @@
+import random
+import re
+
+#Category keywords taken from the labelling prompt, plus common Chinese equivalents
+CATEGORY_KEYWORDS = {
+    "1": ["working", "works", "worked", "operational", "functional", "broken", "dead", "offline", "problems",
+          "issues", "error", "fault", "faulty", "neveikia", "disabled", "maintenance", "fixed", "repair",
+          "out of order", "not working", "doesn't work", "does not work", "used to work",
+          "坏", "故障", "不能充", "充不上", "维修"],
+    "2": ["kw", "kwh", "amps", "volts", "slow", "quick", "fast", "charging speed", "11kw", "22kw", "45kw", "50kw",
+          "mph", "peak", "throttled", "充电快", "充电慢", "功率", "速度"],
+    "3": ["location", "parking", "spots", "blocked", "spaces", "occupied", "find", "locate", "access", "stalls",
+          "bay", "iced", "iceing", "busy", "full", "hard to find", "位置", "停车", "车位", "占用", "难找"],
+    "4": ["price", "cost", "expensive", "cheap", "cents", "fee", "gratis", "free", "vend", "kostenlos",
+          "parking fee", "app", "account", "card", "pay", "payment", "activate", "subscription",
+          "价格", "收费", "免费", "便宜", "贵", "支付", "扫码"],
+    "5": ["clean", "dirty", "helpful", "friendly", "quiet", "noisy", "amenities", "environment", "staff",
+          "restroom", "toilet", "shop", "cafe", "restaurant", "lighting", "safe", "环境", "服务", "干净", "厕所"],
+}
+#Praise and complaint words that carry sentiment but no category of their own
+POSITIVE = ["good", "great", "nice", "excellent", "perfect", "love", "awesome", "fantastic", "super", "easy",
+            "convenient", "works", "working", "worked", "fast", "quick", "free", "clean", "friendly", "helpful",
+            "thanks", "thank you", "好", "不错", "方便", "满意", "快", "免费", "干净"]
+NEGATIVE = ["bad", "terrible", "awful", "horrible", "broken", "dead", "offline", "error", "fault", "faulty",
+            "slow", "expensive", "blocked", "occupied", "iced", "dirty", "noisy", "not working", "doesn't work",
+            "does not work", "out of order", "disabled", "stopped working", "stops working", "quit working",
+            "nothing works", "never works", "no longer works", "used to work", "used to be free", "no longer free",
+            "坏", "故障", "差", "慢", "贵", "占用", "不能充", "充不上"]
+#The prompt asks for English keywords
+TRANSLATIONS = {
+    "坏": "broken", "故障": "fault", "不能充": "cannot charge", "充不上": "cannot charge", "维修": "repair",
+    "充电快": "fast charging", "充电慢": "slow charging", "功率": "power", "速度": "speed",
+    "位置": "location", "停车": "parking", "车位": "parking space", "占用": "occupied", "难找": "hard to find",
+    "价格": "price", "收费": "fee", "免费": "free", "便宜": "cheap", "贵": "expensive", "支付": "payment",
+    "扫码": "scan to pay", "环境": "environment", "服务": "service", "干净": "clean", "厕所": "toilet",
+    "好": "good", "不错": "good", "方便": "convenient", "满意": "satisfied", "快": "fast", "差": "bad", "慢": "slow",
+}
+#Also words that turn praise such as "works" or "free" into a complaint: "quit", "nothing", "used to"
+NEGATION = ["not", "no", "never", "cannot", "without", "hardly", "but", "however", "stopped", "stops", "quit",
+            "nothing", "none", "nobody", "neither", "nor", "no longer", "anymore", "used to",
+            "isn't", "aren't", "wasn't", "weren't", "don't", "doesn't", "didn't", "can't", "couldn't", "won't",
+            "wouldn't", "shouldn't", "hasn't", "haven't", "hadn't", "ain't", "不", "没", "无", "但"]
+#Matched at the end of any word, so contractions missing from NEGATION still count
+NEGATION_SUFFIXES = ["n't"]
+#Reviews longer than this are rarely about one thing
+SHORT_REVIEW_WORDS = 12
+
+def compile_terms(terms, suffixes=()):
+    #word boundaries for Latin-script terms, plain substrings for CJK
+    parts = []
+    for term in sorted(terms, key=len, reverse=True):
+        escaped = re.escape(term)
+        parts.append(escaped if re.search(r"[^\x00-\x7f]", term) else rf"(?<![\w']){escaped}(?![\w'])")
+    #suffixes only need to end a word: "n't" inside "isn't"
+    parts.extend(rf"{re.escape(suffix)}(?![\w'])" for suffix in suffixes)
+    return re.compile("|".join(parts), re.IGNORECASE)
+
+CATEGORY_PATTERNS = {category: compile_terms(terms) for category, terms in CATEGORY_KEYWORDS.items()}
+POSITIVE_PATTERN = compile_terms(POSITIVE)
+NEGATIVE_PATTERN = compile_terms(NEGATIVE)
+NEGATION_PATTERN = compile_terms(NEGATION, NEGATION_SUFFIXES)
+
+def classify(text):
+    """Lexicon verdict "[sentiment],[category],[keywords]" and its confidence in [0, 1]"""
+    #typographic apostrophes, so "isn’t" reads like "isn't"
+    lowered = text.lower().replace("’", "'")
+    negative = NEGATIVE_PATTERN.findall(lowered)
+    #"not working" must not also count as "working"
+    positive = POSITIVE_PATTERN.findall(NEGATIVE_PATTERN.sub(" ", lowered))
+    if bool(positive) == bool(negative):
+        return None, 0.0
+    sentiment = "7" if positive else "6"
+
+    hits = {category: pattern.findall(lowered) for category, pattern in CATEGORY_PATTERNS.items()}
+    hits = {category: found for category, found in hits.items() if found}
+    if hits:
+        ranked = sorted(hits, key=lambda category: len(hits[category]), reverse=True)
+        category = ranked[0]
+        category_confidence = len(hits[category]) / sum(len(found) for found in hits.values())
+        keywords = hits[category]
+    else:
+        #generic praise or complaint only
+        category = "5"
+        category_confidence = 0.8
+        keywords = positive or negative
+
+    #negation left over once the matched phrases are removed can flip the meaning
+    remainder = POSITIVE_PATTERN.sub(" ", NEGATIVE_PATTERN.sub(" ", lowered))
+    negation_factor = 0.5 if NEGATION_PATTERN.search(remainder) else 1.0
+    words = max(1, len(lowered.split()), len(re.findall(r"[一-鿿]", lowered)) // 2)
+    length_factor = min(1.0, SHORT_REVIEW_WORDS / words)
+
+    confidence = category_confidence * negation_factor * length_factor
+    keywords = list(dict.fromkeys(TRANSLATIONS.get(keyword, keyword) for keyword in keywords))[:3]
+    return f"{sentiment},{category},{','.join(keywords)}", confidence
+
+def same_label(a, b):
+    """
+    (sentiment agrees, sentiment and category agree) for a lexicon answer a and an LLM answer b
+
+    b may be an aspects-mode answer, whose category field holds one sentiment digit per category 1-5;
+    the category then agrees when b gives a's category the same sentiment.
+    """
+    a_parts = [part.strip() for part in (a or "").split(",")]
+    b_parts = [part.strip() for part in (b or "").split(",")]
+    sentiment = a_parts[:1] == b_parts[:1]
+    if len(a_parts) > 1 and len(b_parts) > 1 and re.fullmatch(r"[0678]{5}", b_parts[1]):
+        category = a_parts[1]
+        agrees = category in ("1", "2", "3", "4", "5") and b_parts[1][int(category) - 1] == a_parts[0]
+        return sentiment, sentiment and agrees
+    return sentiment, sentiment and a_parts[1:2] == b_parts[1:2]
+
+class LexiconCascade:
+    def __init__(self, threshold=0.9, sample_rate=0.05, seed=0):
+        """
+        Label confident reviews from the lexicon and send the rest to the LLM
+
+        Parameters:
+            threshold: Minimum lexicon confidence for a review to skip the LLM
+            sample_rate: Fraction of confident reviews also sent to the LLM to measure agreement
+            seed: Seed of the audit sampling
+        """
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.rng = random.Random(seed)
+        self.total = 0
+        self.confident = 0
+        self.audited = 0
+        self.agree_sentiment = 0
+        self.agree_both = 0
+
+    def label(self, contents, llm_label):
+        """
+        Verdicts and confidences for contents
+
+        llm_label(list of texts) returns (verdicts, confidences) and is only called for ambiguous or audited reviews
+        """
+        verdicts = [classify(text) for text in contents]
+        to_llm = []
+        audit = set()
+        for i, (verdict, confidence) in enumerate(verdicts):
+            if confidence < self.threshold:
+                to_llm.append(i)
+            else:
+                self.confident += 1
+                if self.rng.random() < self.sample_rate:
+                    to_llm.append(i)
+                    audit.add(i)
+        self.total += len(contents)
+
+        labels = [verdict for verdict, _ in verdicts]
+        confidences = [{"lexicon": round(confidence, 4)} for _, confidence in verdicts]
+        if to_llm:
+            responses, llm_confidences = llm_label([contents[i] for i in to_llm])
+            for i, response, llm_confidence in zip(to_llm, responses, llm_confidences):
+                if i in audit:
+                    sentiment, both = same_label(labels[i], response)
+                    self.audited += 1
+                    self.agree_sentiment += sentiment
+                    self.agree_both += both
+                #the LLM verdict is kept whenever there is one
+                labels[i] = response
+                confidences[i] = llm_confidence
+        return labels, confidences
+
+    def report(self):
+        routed = self.confident / self.total if self.total else 0.0
+        if not self.audited:
+            return f"Lexicon cascade: {self.confident}/{self.total} reviews ({routed:.1%}) confidently labelled by the lexicon"
+        return (f"Lexicon cascade: {self.confident}/{self.total} reviews ({routed:.1%}) confidently labelled by the lexicon, "
+                f"agreement with the LLM on {self.audited} audited: sentiment {self.agree_sentiment / self.audited:.1%}, "
+                f"sentiment and category {self.agree_both / self.audited:.1%}")
@@ -0,0 +1,459 @@
+import copy
+import gc
+import hashlib
+import json
+import os
+import random
+import time
+import urllib.request
+import urllib.error
+
+from prompts import PROMPTS
+from token_store import TOKEN_STORE_DIR, open_store, store_version
+
+MAX_NEW_TOKENS = 10
+#The five aspect digits of the aspects mode take the place of one category digit
+ASPECT_EXTRA_TOKENS = 4
+#Fraction of free device memory the KV cache of one batch may take
+MEMORY_FRACTION = 0.6
+#Stands in for the review while the static part of the prompt is encoded
+COMMENT_SLOT = "\x00COMMENT\x00"
+#Reviews whose cached-prefix encoding is checked against the whole prompt when the prefix is built
+PREFIX_CHECK_REVIEWS = ["Great charger, fast and free.", "环境差，充电慢", "  broken again!!", "Ładowarka nie działa",
+                        "\nPaid 0.79/kWh"]
+#Small model of the same tokenizer family proposing answers for speculative decoding, e.g. Qwen/Qwen3-0.6B
+DRAFT_MODEL = os.environ.get("LLM_DRAFT_MODEL")
+
+def chat_prompt(tokenizer, prompt, current_comment):
+    messages = [
+                    {"role": "user", "content": prompt(current_comment)}]
+    return tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True,
+        enable_thinking=False
+    )
+
+def prompt_parts(tokenizer, prompt):
+    """
+    (prefix, lead, tail head, tail rest) of the chat prompt around the review
+
+    The lead is the whitespace the prefix ends with ("Now analyze: "): byte-level tokenizers merge a
+    space into the word after it (" Great"), so it is tokenized with the review rather than the prefix.
+    The tail head is the end of the user message up to the first special token; it can merge with the
+    last characters of the review, so it is tokenized together with it too. Tokenization always splits
+    at special tokens, so the rest can be tokenized once and appended.
+    """
+    prefix, tail = chat_prompt(tokenizer, prompt, COMMENT_SLOT).split(COMMENT_SLOT)
+    stripped = prefix.rstrip()
+    cut = min((tail.find(token) for token in tokenizer.all_special_tokens if token in tail), default=len(tail))
+    return stripped, prefix[len(stripped):], tail[:cut], tail[cut:]
+
+class TransformersBackend:
+    def __init__(self, model_name="Qwen/Qwen3-14B", quantize=True, device_map="auto",
+                 use_prefix_cache=True, constrained=True, mode="single", token_store=TOKEN_STORE_DIR,
+                 draft_model=DRAFT_MODEL):
+        """
+        Labelling backend on a Hugging Face causal LM
+
+        Parameters:
+            model_name: Hugging Face model id
+            quantize: Load the weights in 4-bit NF4 with bitsandbytes
+            device_map: Passed to from_pretrained ("auto", "cpu", ...)
+            use_prefix_cache: Encode the instruction block once and reuse its KV cache
+            constrained: Only allow "[6-8],[1-5 or 9],[keywords]" and stop at the end of the answer
+            mode: "single" labels the most relevant category, "aspects" the sentiment of every category
+            token_store: Directory of pre-tokenized reviews (see token_store.py), or None to always tokenize
+            draft_model: Hugging Face id of a small model sharing the tokenizer; its proposed answer is verified
+                by the main model in one forward pass (speculative decoding, same output as plain greedy decoding)
+        """
+        if mode not in PROMPTS:
+            raise ValueError(f"Unknown mode {mode!r}, expected one of {sorted(PROMPTS)}")
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+
+        self.torch = torch
+        self.model_name = model_name
+        self.use_prefix_cache = use_prefix_cache
+        self.constrained = constrained
+        self.token_store = token_store
+        self.use_prompt(PROMPTS[mode], mode)
+
+        model_kwargs = {"device_map": device_map}
+        if quantize:
+            #Configure 4-bit quantization
+            model_kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_use_double_quant=True,
+            )
+        elif device_map == "cpu":
+            model_kwargs["torch_dtype"] = torch.float32
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForCausalLM.from_pretrained(model_name, **model_kwargs)
+        self.draft = None
+        if draft_model:
+            self.draft = AutoModelForCausalLM.from_pretrained(
+                draft_model, device_map={"": self.model.device},
+                torch_dtype=torch.float16 if self.model.device.type == "cuda" else torch.float32)
+            #propose the whole short answer at once instead of growing the guess step by step
+            self.draft.generation_config.num_assistant_tokens = self.max_new_tokens
+            self.draft.generation_config.num_assistant_tokens_schedule = "constant"
+        self.speculative = self.draft is not None
+        #Left padding so every row of a batch ends at the generation position
+        self.tokenizer.padding_side = "left"
+
+    def use_prompt(self, prompt, mode):
+        """Label with prompt(review), whose answers follow the "single" or "aspects" format"""
+        self.prompt = prompt
+        self.mode = mode
+        self.max_new_tokens = MAX_NEW_TOKENS + (ASPECT_EXTRA_TOKENS if mode == "aspects" else 0)
+        self._prefix = {}
+
+    def build_prompt(self, current_comment):
+        return chat_prompt(self.tokenizer, self.prompt, current_comment)
+
+    def version(self):
+        """Hash of model, decoding settings and prompt, so cached verdicts are invalidated when they change"""
+        #greedy decoding; earlier verdicts were sampled with the model's default generation config
+        settings = f"{self.model_name}|constrained={self.constrained}|greedy|"
+        if self.mode != "single":
+            #the default mode is left out of the hash
+            settings += f"mode={self.mode}|"
+        return hashlib.sha1((settings + self.build_prompt(COMMENT_SLOT)).encode("utf-8")).hexdigest()[:16]
+
+    def sync(self):
+        if self.torch.cuda.is_available():
+            self.torch.cuda.synchronize()
+
+    def release_memory(self):
+        gc.collect()
+        if self.torch.cuda.is_available():
+            self.torch.cuda.empty_cache()
+
+    def peak_memory(self):
+        if not self.torch.cuda.is_available():
+            return None
+        return sum(self.torch.cuda.max_memory_allocated(i) for i in range(self.torch.cuda.device_count()))
+
+    def prompt_prefix(self):
+        """Token ids and KV cache of the instruction block shared by every review, computed once"""
+        if not self._prefix:
+            prefix_text, lead, tail_head, tail_rest = prompt_parts(self.tokenizer, self.prompt)
+            prefix_ids = self.tokenizer(prefix_text, return_tensors="pt").input_ids.to(self.model.device)
+            with self.torch.no_grad():
+                past_key_values = self.model(prefix_ids, use_cache=True).past_key_values
+            store = open_store(self.token_store, store_version(self.tokenizer, lead, tail_head)) if self.token_store else None
+            self._prefix.update(ids=prefix_ids, lead=lead, tail=tail_head + tail_rest, tail_head=tail_head,
+                                tail_head_len=len(self.tokenizer(tail_head, add_special_tokens=False)["input_ids"]),
+                                tail_ids=self.tokenizer(tail_rest, add_special_tokens=False)["input_ids"],
+                                store=store, past_key_values=past_key_values)
+            try:
+                self.check_prefix_split()
+            except ValueError:
+                self._prefix.clear()
+                raise
+        return self._prefix
+
+    def check_prefix_split(self, reviews=PREFIX_CHECK_REVIEWS):
+        """Raise ValueError unless the cached prefix followed by each encoded review is the tokenized whole prompt"""
+        prefix = self._prefix
+        #tokenized like encode() does, without adding the samples to the token store
+        encoded = self.tokenizer([prefix["lead"] + review + prefix["tail_head"] for review in reviews],
+                                 add_special_tokens=False)["input_ids"]
+        prefix_ids = prefix["ids"][0].tolist()
+        for review, ids in zip(reviews, encoded):
+            ids = ids + prefix["tail_ids"]
+            expected = self.tokenizer(self.build_prompt(review))["input_ids"]
+            if prefix_ids + ids != expected:
+                raise ValueError(f"Prefix cache splits the prompt of {review!r} into different tokens than "
+                                 f"the whole prompt; run with use_prefix_cache=False for {self.model_name}")
+
+    def prefix_len(self):
+        return self.prompt_prefix()["ids"].shape[1] if self.use_prefix_cache else 0
+
+    def instruction_tokens(self):
+        """Tokens every review pays for the prompt around it"""
+        return len(self.tokenizer(self.build_prompt(""))["input_ids"])
+
+    def encode(self, comments):
+        #With the prefix cache only the review and the closing chat template are encoded
+        if self.use_prefix_cache:
+            prefix = self.prompt_prefix()
+            if not prefix["store"]:
+                return self.tokenizer([prefix["lead"] + comment + prefix["tail"] for comment in comments],
+                                      add_special_tokens=False)["input_ids"]
+            #stored ids cover the lead, the review and the tail head; reviews seen for the first time are added
+            ids = prefix["store"].get_many(comments)
+            missing = [i for i, found in enumerate(ids) if found is None]
+            if missing:
+                texts = [comments[i] for i in missing]
+                new_ids = self.tokenizer([prefix["lead"] + text + prefix["tail_head"] for text in texts],
+                                         add_special_tokens=False)["input_ids"]
+                prefix["store"].put_many(texts, new_ids)
+                for i, found in zip(missing, new_ids):
+                    ids[i] = found
+            return [found + prefix["tail_ids"] for found in ids]
+        return self.tokenizer([self.build_prompt(comment) for comment in comments])["input_ids"]
+
+    def review_lengths(self, comments):
+        """Token counts of comments read from the token store, None for reviews it does not hold yet"""
+        prefix = self.prompt_prefix() if self.use_prefix_cache else {}
+        if not prefix.get("store"):
+            return [None] * len(comments)
+        #stored ids also cover the tail head; the lead mostly merges into the review's first token
+        return [None if length is None else length - prefix["tail_head_len"]
+                for length in prefix["store"].lengths(comments)]
+
+    def review_tokens(self, comments):
+        return self.tokenizer(list(comments), add_special_tokens=False)["input_ids"]
+
+    def decode_review(self, ids):
+        return self.tokenizer.decode(ids)
+
+    def review_budget(self, budget):
+        return budget
+
+    def batch_limit(self, max_batch_size):
+        return max_batch_size
+
+    def auto_batch_size(self, seq_len, max_batch_size):
+        """Largest batch whose KV cache for seq_len tokens fits in the free device memory"""
+        if self.speculative:
+            #assisted generation verifies one sequence at a time
+            return 1
+        if not self.torch.cuda.is_available():
+            return max_batch_size
+        free_bytes, _ = self.torch.cuda.mem_get_info(self.model.device)
+        config = self.model.config
+        head_dim = getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+        kv_heads = getattr(config, "num_key_value_heads", None) or config.num_attention_heads
+        #keys + values, fp16
+        bytes_per_token = 2 * config.num_hidden_layers * kv_heads * head_dim * 2
+        fit = int(free_bytes * MEMORY_FRACTION // (bytes_per_token * (seq_len + self.max_new_tokens)))
+        return max(1, min(max_batch_size, fit))
+
+    def generate(self, batch_ids):
+        from transformers import LogitsProcessorList
+        from constrained_decoding import AnswerFormatProcessor, label_confidence
+
+        if self.speculative and len(batch_ids) > 1:
+            #assisted generation verifies one sequence at a time
+            results = [self.generate([ids]) for ids in batch_ids]
+            return [response for responses, _ in results for response in responses], {
+                "generated_tokens": sum(info["generated_tokens"] for _, info in results),
+                "confidence": [confidence for _, info in results for confidence in info["confidence"]],
+            }
+
+        torch = self.torch
+        inputs = self.tokenizer.pad({"input_ids": batch_ids}, return_tensors="pt").to(self.model.device)
+        input_ids, attention_mask = inputs.input_ids, inputs.attention_mask
+        generate_kwargs = {}
+        if self.use_prefix_cache:
+            #[prefix][pad][review]: position ids come from the attention mask, so the gap is harmless
+            prefix = self.prompt_prefix()
+            n = input_ids.shape[0]
+            input_ids = torch.cat([prefix["ids"].expand(n, -1), input_ids], dim=1)
+            attention_mask = torch.cat([torch.ones_like(prefix["ids"]).expand(n, -1), attention_mask], dim=1)
+            past_key_values = copy.deepcopy(prefix["past_key_values"])
+            past_key_values.batch_repeat_interleave(n)
+            generate_kwargs["past_key_values"] = past_key_values
+        if self.constrained:
+            #applied to the draft's proposals as well, so they follow the answer format too
+            generate_kwargs["logits_processor"] = LogitsProcessorList(
+                [AnswerFormatProcessor(self.tokenizer, input_ids.shape[1], self.mode)])
+        if self.speculative:
+            #the draft encodes the whole prompt itself; the prefix cache only serves the main model
+            generate_kwargs["assistant_model"] = self.draft
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=self.max_new_tokens,
+                #greedy, so repeated runs and speculative decoding give the same answer
+                do_sample=False,
+                temperature=None,
+                top_p=None,
+                top_k=None,
+                pad_token_id=self.tokenizer.pad_token_id,
+                #raw logits of the same pass give label confidences without another forward
+                return_dict_in_generate=True,
+                output_logits=True,
+                **generate_kwargs
+            )
+        generated = outputs.sequences[:, input_ids.shape[1]:]
+        decoded = self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+        info = {
+            "generated_tokens": int((generated != self.tokenizer.pad_token_id).sum()),
+            "confidence": label_confidence(self.tokenizer, outputs.logits, generated, self.mode),
+        }
+        return [response.strip() for response in decoded], info
+
+class CPUBackend(TransformersBackend):
+    def __init__(self, model_name="Qwen/Qwen3-0.6B", **kwargs):
+        """Small unquantized model on the CPU, for local runs without a GPU"""
+        super().__init__(model_name, quantize=False, device_map="cpu", **kwargs)
+
+class StubBackend:
+    def __init__(self, batch_latency=0.05, token_latency=0.00005, prefix_tokens=700, mode="single"):
+        """
+        Deterministic stand-in for the model, for testing throughput without one
+
+        Parameters:
+            batch_latency: Seconds slept per generate call
+            token_latency: Seconds slept per padded prompt token in the batch
+            prefix_tokens: Pretended length of the instruction prompt
+            mode: "single" or "aspects" answer format
+        """
+        self.model_name = "stub"
+        self.mode = mode
+        self.batch_latency = batch_latency
+        self.token_latency = token_latency
+        self.prefix_tokens = prefix_tokens
+
+    def use_prompt(self, prompt, mode):
+        self.mode = mode
+        #roughly four bytes of English per token
+        self.prefix_tokens = len(prompt("").encode("utf-8")) // 4
+
+    def version(self):
+        return "stub" if self.mode == "single" else f"stub-{self.mode}"
+
+    def sync(self):
+        pass
+
+    def peak_memory(self):
+        return None
+
+    def release_memory(self):
+        pass
+
+    def prefix_len(self):
+        return self.prefix_tokens
+
+    def instruction_tokens(self):
+        return self.prefix_tokens
+
+    def encode(self, comments):
+        #One "token" per UTF-8 byte keeps lengths proportional to the review
+        return [list(comment.encode("utf-8")) or [0] for comment in comments]
+
+    def review_lengths(self, comments):
+        return [len(comment.encode("utf-8")) for comment in comments]
+
+    def review_tokens(self, comments):
+        return [list(comment.encode("utf-8")) for comment in comments]
+
+    def decode_review(self, ids):
+        return bytes(ids).decode("utf-8", errors="ignore")
+
+    def review_budget(self, budget):
+        return budget
+
+    def batch_limit(self, max_batch_size):
+        return max_batch_size
+
+    def auto_batch_size(self, seq_len, max_batch_size):
+        return max_batch_size
+
+    def generate(self, batch_ids):
+        padded = max(len(ids) for ids in batch_ids)
+        time.sleep(self.batch_latency + self.token_latency * padded * len(batch_ids))
+        responses = []
+        confidences = []
+        generated_tokens = 0
+        for ids in batch_ids:
+            rng = random.Random(hashlib.sha1(bytes(ids)).hexdigest())
+            sentiment = rng.choice("678")
+            keywords = bytes(ids).decode("utf-8", errors="ignore").split()[:2] or ["none"]
+            confidence = {"sentiment": round(rng.uniform(0.5, 1), 4)}
+            if self.mode == "aspects":
+                category = "".join(rng.choice("0006786") for _ in range(5))
+                confidence.update((f"aspect{i}", round(rng.uniform(0.3, 1), 4)) for i in range(1, 6))
+            else:
+                category = rng.choice("123459")
+                confidence["category"] = round(rng.uniform(0.3, 1), 4)
+            responses.append(f"{sentiment},{category},{','.join(keywords)}")
+            confidences.append(confidence)
+            generated_tokens += len(responses[-1])
+        return responses, {"generated_tokens": generated_tokens, "confidence": confidences}
+
+class RemoteBackend:
+    def __init__(self, url=None, request_size=256, timeout=600, mode=None):
+        """
+        Thin client of llm_server.py, which keeps the model loaded between runs
+
+        Parameters:
+            url: Server address, defaults to $LLM_SERVER_URL or http://127.0.0.1:8765
+            request_size: Reviews sent per request; the server batches them by length itself
+            timeout: Seconds to wait for one request
+            mode: Expected labelling mode of the server, or None to accept whatever it serves
+        """
+        self.url = (url or os.environ.get("LLM_SERVER_URL", "http://127.0.0.1:8765")).rstrip("/")
+        self.request_size = request_size
+        self.timeout = timeout
+        self.peak_device_memory = None
+        server = self.call("/version")
+        self.model_name = server["model"]
+        self.server_version = server["version"]
+        self.mode = server.get("mode", "single")
+        if mode is not None and mode != self.mode:
+            raise ValueError(f"Server at {self.url} labels in {self.mode!r} mode, not {mode!r}")
+
+    def call(self, path, payload=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"Labelling server error: {json.loads(e.read()).get('error')}") from e
+
+    def version(self):
+        return self.server_version
+
+    def sync(self):
+        pass
+
+    def peak_memory(self):
+        return self.peak_device_memory
+
+    def release_memory(self):
+        pass
+
+    def prefix_len(self):
+        return 0
+
+    def encode(self, comments):
+        #tokenization happens on the server; the raw text only orders the requests
+        return list(comments)
+
+    def review_budget(self, budget):
+        #the server bounds reviews itself with the model's tokenizer, so remote and local runs chunk alike
+        return None
+
+    def batch_limit(self, max_batch_size):
+        #the server batches each request again by length and free memory, so the local cap does not apply
+        return self.request_size
+
+    def auto_batch_size(self, seq_len, max_batch_size):
+        return self.request_size
+
+    def generate(self, batch_ids):
+        result = self.call("/label", {"comments": list(batch_ids)})
+        self.peak_device_memory = result["peak_device_memory"]
+        return result["responses"], {"generated_tokens": result["generated_tokens"], "confidence": result["confidence"]}
+
+BACKENDS = {
+    "transformers": TransformersBackend,
+    "cpu": CPUBackend,
+    "stub": StubBackend,
+    "remote": RemoteBackend,
+}
+
+def load_backend(name, **kwargs):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
@@ -0,0 +1,78 @@
+import json
+import os
+import resource
+import threading
+import time
+from collections import deque
+
+#Batches the rolling latency percentiles are taken over
+WINDOW = 1000
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))], 4)
+
+def peak_host_memory():
+    #ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class MetricsLogger:
+    def __init__(self, path):
+        """
+        Per-batch throughput and latency metrics, one JSON line per batch
+
+        Parameters:
+            path: JSONL file the records are appended to
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.f = open(path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=WINDOW)
+        self.gauges = {}
+        self.started = time.perf_counter()
+        self.totals = {"batches": 0, "reviews": 0, "prompt_tokens": 0, "generated_tokens": 0, "seconds": 0.0}
+
+    def set_gauge(self, name, value):
+        """Values such as queue depth or cache hit rate that are attached to the following records"""
+        self.gauges[name] = value
+
+    def record_batch(self, reviews, prompt_tokens, padded_tokens, generated_tokens, latency, device_memory=None):
+        with self.lock:
+            self.latencies.append(latency)
+            for key, value in [("batches", 1), ("reviews", reviews), ("prompt_tokens", prompt_tokens),
+                               ("generated_tokens", generated_tokens), ("seconds", latency)]:
+                self.totals[key] += value
+            record = {
+                "time": time.time(),
+                "reviews": reviews,
+                "prompt_tokens": prompt_tokens,
+                "padded_tokens": padded_tokens,
+                "generated_tokens": generated_tokens,
+                "latency_s": round(latency, 4),
+                "prompt_tokens_per_s": round(prompt_tokens / latency, 1) if latency else None,
+                "generated_tokens_per_s": round(generated_tokens / latency, 1) if latency else None,
+                "latency_p50_s": percentile(self.latencies, 50),
+                "latency_p90_s": percentile(self.latencies, 90),
+                "latency_p99_s": percentile(self.latencies, 99),
+                "peak_device_memory": device_memory,
+                "peak_host_memory": peak_host_memory(),
+                **self.gauges,
+            }
+            self.f.write(json.dumps(record) + "\n")
+            self.f.flush()
+
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        totals = self.totals
+        return (f"Batches {totals['batches']}, reviews {totals['reviews']}, "
+                f"{totals['reviews'] / wall:.1f} reviews/s over {wall:.1f} s, "
+                f"prompt {totals['prompt_tokens']} tokens, generated {totals['generated_tokens']} tokens, "
+                f"batch latency p50 {percentile(self.latencies, 50) or 0:.3f} s, "
+                f"p99 {percentile(self.latencies, 99) or 0:.3f} s")
+
+    def close(self):
+        with self.lock:
+            self.f.write(json.dumps({"time": time.time(), "summary": self.summary(), **self.totals}) + "\n")
+            self.f.close()
@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from LLM import LLM_BACKEND, LABEL_MODE, REVIEW_LENGTH_MODE, REVIEW_TOKEN_LIMIT, analyze_sentiment_batch
+from llm_backends import load_backend
+from llm_metrics import MetricsLogger
+from review_length import TokenBudget
+
+HOST = os.environ.get("LLM_SERVER_HOST", "127.0.0.1")
+PORT = int(os.environ.get("LLM_SERVER_PORT", "8765"))
+SERVER_METRICS_FILE = os.path.join("Data","interim","LLM_result","server_metrics.jsonl")
+
+class LabelHandler(BaseHTTPRequestHandler):
+    def reply(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/version":
+            backend = self.server.backend
+            self.reply(200, {"version": backend.version(), "model": backend.model_name, "mode": backend.mode})
+        else:
+            self.reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/label":
+            self.reply(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            #one batch at a time on the resident model; concurrent clients queue here
+            with self.server.lock:
+                metrics = self.server.metrics
+                before = metrics.totals["generated_tokens"]
+                responses, confidences = analyze_sentiment_batch(request["comments"], request.get("batch_size"),
+                                                                 self.server.backend, metrics, self.server.budget,
+                                                                 with_confidence=True)
+                generated_tokens = metrics.totals["generated_tokens"] - before
+            self.reply(200, {
+                "responses": responses,
+                "confidence": confidences,
+                "generated_tokens": generated_tokens,
+                "peak_device_memory": self.server.backend.peak_memory(),
+            })
+        except Exception as e:
+            self.reply(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(backend_name=LLM_BACKEND, host=HOST, port=PORT, metrics_file=SERVER_METRICS_FILE, mode=LABEL_MODE):
+    """Load the backend once and label batches posted to http://host:port/label until interrupted"""
+    server = ThreadingHTTPServer((host, port), LabelHandler)
+    server.backend = load_backend(backend_name, mode=mode)
+    server.metrics = MetricsLogger(metrics_file)
+    server.lock = threading.Lock()
+    #long reviews are chunked here, where the model's tokenizer is, for every client alike
+    server.budget = TokenBudget(REVIEW_TOKEN_LIMIT, REVIEW_LENGTH_MODE) if REVIEW_TOKEN_LIMIT else None
+    print(f"Serving {server.backend.model_name} ({mode} mode) on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.metrics.summary())
+        server.metrics.close()
+        if server.budget:
+            print(server.budget.report())
+
+if __name__ == "__main__":
+    serve()
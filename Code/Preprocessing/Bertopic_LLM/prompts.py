@@ -0,0 +1,80 @@
+CATEGORY_DEFINITIONS = """        category:
+        1. **Charging Functionality & Reliability** - ONLY basic functionality: Assess comments about hardware operation, faults, offline status, damage, and reliability. Keywords include but are not limited to working, works, operational, functional, broken, dead, offline, problems, issues, error, fault, neveikia, disabled, maintenance, fixed, repair, power, units. 
+        2. **Charging Performance** - Evaluate mentions of technical metrics: charging speed, power output (kW/kWh/Amps/Volts).Keywords include but are not limited to kw, kwh, amps, volts, rate, max, slow, quick, fast, charging fast, charging speed fast, 11kw, 45kw, miles, mph, top, peak.
+        3. **Location & Availability** - Judge feedback about geographical placement, discoverability, parking space availability, and obstruction issues (e.g., ICEing).Keywords include but are not limited to location, parking, spots, blocked, spaces, occupied, find, locate, access, stalls, open, convenient, easy, difficult, bay, empty, full, busy, parking, occupied.
+        4. **Pricing & Payment** - Analyze comments regarding costs, additional fees, and payment process/methods (apps, cards, etc.).Keywords include but are not limited to price, cost, expensive, cents, rate, fee, gratis, free, vend, kostenlos, charges, parking fee, too expensive, app, account, card, network, pay, activate, service.
+        5. **Environment & Service** - Evaluate surroundings (cleanliness, noise), amenities, staff service, and user comfort.Keywords include but are not limited to good, great, nice, excellent, experience, convenient, easy, simple, clean, helpful, service, friendly, quiet, amenities, environment, love, place, super, fantastic, perfect, awesome, review, satisfied. 
+        9. **Other** - Review does not belong to any of the above categories.
+        - Charging Functionality & Reliability ONLY covers basic function. Examples:  
+        - "Charges very fast" → [category] = Charging Performance  
+        - "Charger is broken" → [category] = Charging Functionality & Reliability"""
+
+KEYWORD_RULES = """        Key words Extraction:
+        - Key words MUST be extracted from the review AND TRANSLATED TO ENGLISH. Do not include non-English words in the final output."""
+
+def analysis_prompt(current_comment):
+    """Overall sentiment, the single most relevant category and keywords: "7,1,works" """
+    return f"""
+        Analyze the electric vehicle charging station review. 
+        First determine the overall sentiment (Negative=6, Positive=7, Neutral=8) based on the review.
+        Then, provide the most relevant category (1-5 or other=9) and 1-3 key words
+        **Critical Rules**  
+    
+{CATEGORY_DEFINITIONS}
+
+{KEYWORD_RULES}
+
+        Sentiment Labels:
+        - Negative (6): Explicit complaints (e.g., "环境差，充电慢" → 6,5,bad environment, slow charging).
+        - Positive (7): Explicit praise (e.g., "Worked great. It was our first time to charge our new Bolt. It was easy and intuitive."→ 7,1,Worked great,easy).
+        - Neutral (8): Objective facts (no sentiment)(e.g.,"Charging power: 50kW." → 8,2,power)
+    
+        Answer strictly according to [Overall_Sentiment],[category],[keyword].
+        Now analyze: {current_comment}
+    """
+
+def aspect_prompt(current_comment):
+    """Overall sentiment and the sentiment of every category in one answer: "6,70060,works,expensive" """
+    return f"""
+        Analyze the electric vehicle charging station review. 
+        First determine the overall sentiment (Negative=6, Positive=7, Neutral=8) based on the review.
+        Then, for EACH of the categories 1-5 in order, give the sentiment the review expresses about it
+        (Negative=6, Positive=7, Neutral=8, not mentioned=0), written as five digits without separators, and 1-3 key words
+        **Critical Rules**  
+    
+{CATEGORY_DEFINITIONS}
+
+{KEYWORD_RULES}
+
+        Sentiment Labels:
+        - Negative (6): Explicit complaints (e.g., "环境差，充电慢" → 6,06006,bad environment,slow charging).
+        - Positive (7): Explicit praise (e.g., "Worked great, and free to use."→ 7,70070,worked great,free).
+        - Neutral (8): Objective facts (no sentiment)(e.g.,"Charging power: 50kW." → 8,08000,power)
+        - Mixed reviews keep one digit per category (e.g., "Fast charger but expensive" → 6,07060,fast,expensive).
+    
+        Answer strictly according to [Overall_Sentiment],[five category digits],[keyword].
+        Now analyze: {current_comment}
+    """
+
+def compact_prompt(current_comment):
+    """analysis_prompt without the keyword lists and worked examples, same answer format"""
+    return f"""
+        Label the electric vehicle charging station review as [sentiment],[category],[1-3 English key words].
+        sentiment: Negative=6, Positive=7, Neutral=8 (objective facts only).
+        category, the most relevant one: 1=charger works/broken/offline, 2=charging speed/power (kW),
+        3=location/parking/availability, 4=price/fees/payment, 5=environment/service/amenities, 9=other.
+        Example: "Charger broken again" → 6,1,broken
+        Now analyze: {current_comment}
+    """
+
+#Labelling modes: one category per review, or a sentiment for each of the five categories
+PROMPTS = {
+    "single": analysis_prompt,
+    "aspects": aspect_prompt,
+}
+#Named prompts compared by benchmark_prompts.py: (labelling mode of the answer, prompt)
+PROMPT_VARIANTS = {
+    "full": ("single", analysis_prompt),
+    "compact": ("single", compact_prompt),
+    "aspects": ("aspects", aspect_prompt),
+}
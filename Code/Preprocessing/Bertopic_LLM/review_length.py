@@ -0,0 +1,140 @@
+import re
+import threading
+from collections import Counter
+
+#Upper bounds of the length histogram buckets, in tokens
+BUCKETS = [16, 32, 64, 128, 256, 512, 1024, 2048, 4096, float("inf")]
+#Tie-break when chunks disagree: a complaint anywhere in a long review is what matters most
+SENTIMENT_PRIORITY = {"6": 0, "7": 1, "8": 2}
+#Five per-category digits of an aspects-mode answer, 0 when the category is not mentioned
+ASPECTS_PATTERN = re.compile(r"[0678]{5}")
+
+def parse_verdict(response):
+    parts = [part.strip() for part in (response or "").split(",")]
+    if len(parts) < 2 or parts[0] not in SENTIMENT_PRIORITY:
+        return None
+    return parts[0], parts[1], [part for part in parts[2:] if part]
+
+def valid_verdict(response):
+    """Whether response is a well-formed single-category or aspects answer"""
+    verdict = parse_verdict(response)
+    return bool(verdict) and (verdict[1] in ("1", "2", "3", "4", "5", "9") or bool(ASPECTS_PATTERN.fullmatch(verdict[1])))
+
+def merge_aspects(aspects):
+    """Per category, the highest-priority sentiment any chunk gave it"""
+    merged = ""
+    for digits in zip(*aspects):
+        found = [digit for digit in digits if digit != "0"]
+        merged += min(found, key=SENTIMENT_PRIORITY.get) if found else "0"
+    return merged
+
+def merge_verdicts(responses):
+    """One "[sentiment],[category],[keywords]" answer from the answers of a review's chunks"""
+    verdicts = [verdict for verdict in map(parse_verdict, responses) if verdict]
+    if not verdicts:
+        return responses[0]
+    if all(ASPECTS_PATTERN.fullmatch(category) for _, category, _ in verdicts):
+        #each chunk covers its own part of the review, so every category a chunk mentions is kept
+        sentiments = Counter(sentiment for sentiment, _, _ in verdicts)
+        sentiment = min(sentiments, key=lambda s: (-sentiments[s], SENTIMENT_PRIORITY[s]))
+        aspects = merge_aspects([category for _, category, _ in verdicts])
+        keywords = list(dict.fromkeys(k for _, _, found in verdicts for k in found))[:3]
+        return ",".join([sentiment, aspects] + keywords)
+    sentiments = Counter(sentiment for sentiment, _, _ in verdicts)
+    sentiment = min(sentiments, key=lambda s: (-sentiments[s], SENTIMENT_PRIORITY[s]))
+    agreeing = [verdict for verdict in verdicts if verdict[0] == sentiment]
+    categories = Counter(category for _, category, _ in agreeing)
+    #"other" only wins when no chunk found a real category
+    if len(categories) > 1:
+        categories.pop("9", None)
+    category = categories.most_common(1)[0][0]
+    keywords = list(dict.fromkeys(k for _, c, found in agreeing if c == category for k in found))[:3]
+    return ",".join([sentiment, category] + keywords)
+
+class TokenBudget:
+    def __init__(self, max_tokens=256, mode="chunk"):
+        """
+        Bound the review part of each prompt to max_tokens
+
+        Parameters:
+            max_tokens: Longest review, in tokens of the backend's tokenizer, sent in one prompt
+            mode: "truncate" keeps the first max_tokens, "chunk" labels every window and merges the verdicts
+        """
+        if mode not in ("truncate", "chunk"):
+            raise ValueError(f"mode must be 'truncate' or 'chunk', not {mode!r}")
+        self.max_tokens = max_tokens
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.histogram = [0] * len(BUCKETS)
+        self.longest = 0
+        self.over_limit = 0
+        self.extra_chunks = 0
+
+    def split(self, comments, backend):
+        """Texts to label and, for each, the index of the review it came from"""
+        lengths = backend.review_lengths(comments)
+        #the stored count can be a token off where the review merges with the prompt after it, so only
+        #reviews missing from the token store or near the limit go through the tokenizer here
+        exact = [i for i, length in enumerate(lengths) if length is None or length >= self.max_tokens]
+        tokenized = dict(zip(exact, backend.review_tokens([comments[i] for i in exact]))) if exact else {}
+        pieces, owners = [], []
+        for i, comment in enumerate(comments):
+            ids = tokenized.get(i)
+            length = lengths[i] if ids is None else len(ids)
+            self.observe(length)
+            if length <= self.max_tokens:
+                windows = [None]
+            elif self.mode == "truncate":
+                windows = [ids[:self.max_tokens]]
+            else:
+                windows = [ids[start:start + self.max_tokens] for start in range(0, len(ids), self.max_tokens)]
+                with self.lock:
+                    self.extra_chunks += len(windows) - 1
+            for window in windows:
+                pieces.append(comment if window is None else backend.decode_review(window))
+                owners.append(i)
+        return pieces, owners
+
+    def merge(self, responses, owners, n):
+        grouped = [[] for _ in range(n)]
+        for owner, response in zip(owners, responses):
+            grouped[owner].append(response)
+        return [group[0] if len(group) == 1 else merge_verdicts(group) for group in grouped]
+
+    def merge_confidence(self, confidences, owners, n):
+        """A chunked review is only as certain as its least certain chunk"""
+        grouped = [[] for _ in range(n)]
+        for owner, confidence in zip(owners, confidences):
+            if confidence:
+                grouped[owner].append(confidence)
+        return [{name: min(c[name] for c in group if name in c) for name in set().union(*group)} if group else None
+                for group in grouped]
+
+    def observe(self, length):
+        with self.lock:
+            self.histogram[next(i for i, bound in enumerate(BUCKETS) if length <= bound)] += 1
+            self.longest = max(self.longest, length)
+            self.over_limit += length > self.max_tokens
+
+    def percentile(self, q):
+        """Upper bound of the histogram bucket holding the q-th percentile"""
+        total = sum(self.histogram)
+        seen = 0
+        for bound, count in zip(BUCKETS, self.histogram):
+            seen += count
+            if total and seen / total >= q / 100:
+                return min(bound, self.longest)
+        return 0
+
+    def report(self):
+        total = sum(self.histogram)
+        lines = [f"Review lengths ({total} reviews, tokens): p50 <= {self.percentile(50)}, "
+                 f"p90 <= {self.percentile(90)}, p99 <= {self.percentile(99)}, max {self.longest}; "
+                 f"{self.over_limit} over the {self.max_tokens}-token limit ({self.mode}"
+                 + (f", {self.extra_chunks} extra chunks)" if self.mode == "chunk" else ")")]
+        lower = 0
+        for bound, count in zip(BUCKETS, self.histogram):
+            if count:
+                lines.append(f"  {lower + 1:>5}-{bound:<5}: {count}")
+            lower = bound
+        return "\n".join(lines)
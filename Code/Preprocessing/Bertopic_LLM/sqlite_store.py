@@ -0,0 +1,79 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+#Keys per query, below SQLite's bound-parameter limit
+LOOKUP_CHUNK = 500
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def select_in(conn, query, keys, params=()):
+    """Rows of query for keys, "{}" in query standing for their placeholders and params for the ones before"""
+    keys = list(dict.fromkeys(keys))
+    rows = []
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[start:start + LOOKUP_CHUNK]
+        rows.extend(conn.execute(query.format(",".join("?" * len(chunk))), list(params) + chunk))
+    return rows
+
+class AppendOnlyStore:
+    def __init__(self, directory, data_name, dtype, schema):
+        """
+        Append-only binary file of dtype values, memory-mapped for reading, with a SQLite index into it
+
+        Values are on disk before the index points at them, so a process killed while writing leaves
+        at most an unindexed tail. It is cut off when the store is opened again, which assumes a
+        single writing process per store.
+
+        Parameters:
+            directory: Directory of the data file and index.sqlite, created if missing
+            data_name: File name of the values
+            dtype: numpy dtype of the values
+            schema: CREATE TABLE statements of the index
+        """
+        import numpy as np
+
+        self.np = np
+        self.dtype = np.dtype(dtype)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, data_name)
+        open(self.data_path, "ab").close()
+        self.conn = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        for statement in schema:
+            self.conn.execute(statement)
+        self.lock = threading.Lock()
+        self.data = None
+        self.truncate(self.indexed_size())
+
+    def indexed_size(self):
+        """Number of values the index points into"""
+        raise NotImplementedError
+
+    def truncate(self, size):
+        if os.path.getsize(self.data_path) > size * self.dtype.itemsize:
+            print(f"{self.data_path}: dropping the unindexed tail of an interrupted write")
+            with open(self.data_path, "r+b") as f:
+                f.truncate(size * self.dtype.itemsize)
+
+    def mapped(self, end):
+        """Memory map covering the data file up to value end, remapped only after the file has grown past it"""
+        if self.data is None or len(self.data) < end:
+            self.data = self.np.memmap(self.data_path, dtype=self.dtype, mode="r") if os.path.getsize(self.data_path) else None
+        return self.data
+
+    def write(self, values):
+        """Offset, in values, at which values were appended; they are on disk when this returns"""
+        values = self.np.ascontiguousarray(values, dtype=self.dtype)
+        with open(self.data_path, "ab") as f:
+            offset = f.tell() // self.dtype.itemsize
+            values.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,189 @@
+import os
+import re
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import jieba
+import nltk
+import pandas as pd
+from langdetect import detect, DetectorFactory, LangDetectException
+from nltk.tokenize import word_tokenize
+from tqdm.auto import tqdm
+
+from sqlite_store import select_in, text_hash
+
+NLTK_DATA = "D:\\berttopic\\nltk_data"
+STOPWORDS_FILE = os.path.join("processing_data", "stop_words.txt")
+#Reviews per task handed to a worker process
+PREPROCESS_CHUNK = 2000
+#langdetect results of ambiguous texts, kept across runs
+LANGUAGE_CACHE_FILE = os.path.join("processing_output", "language_cache.sqlite")
+#Scripts that identify the language (or at least its tokenizer) on their own, checked in this order:
+#kana before Han, since Japanese text mixes both
+SCRIPT_LANGUAGES = [
+    ("ja", r"[\u3040-\u30ff]"),
+    ("ko", r"[\uac00-\ud7af\u1100-\u11ff]"),
+    ("zh", r"[\u4e00-\u9fff\u3400-\u4dbf\uf900-\ufaff]"),
+    ("ru", r"[\u0400-\u04ff]"),
+    ("el", r"[\u0370-\u03ff]"),
+    ("ar", r"[\u0600-\u06ff]"),
+    ("he", r"[\u0590-\u05ff]"),
+    ("th", r"[\u0e00-\u0e7f]"),
+]
+LETTER = r"[^\W\d_]"
+
+#Filled once per process by init_worker
+_stopwords = set()
+_language_cache = {}
+
+def load_stopwords(filepath):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return set(line.strip() for line in f if line.strip())
+
+class LanguageCache:
+    def __init__(self, db_path=LANGUAGE_CACHE_FILE):
+        """Persistent langdetect results keyed by the hash of the cleaned text"""
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS languages (text_hash TEXT PRIMARY KEY, lang TEXT)")
+
+    def get_many(self, keys):
+        return dict(select_in(self.conn, "SELECT text_hash, lang FROM languages WHERE text_hash IN ({})", keys))
+
+    def put_many(self, items):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO languages VALUES (?, ?)", items)
+
+    def close(self):
+        self.conn.close()
+
+def init_worker(stopwords_file=STOPWORDS_FILE, language_cache_file=LANGUAGE_CACHE_FILE):
+    """Load the stopwords, jieba's dictionary, NLTK's tokenizer data and the language cache once per worker process"""
+    if NLTK_DATA not in nltk.data.path:
+        nltk.data.path.append(NLTK_DATA)
+    _stopwords.clear()
+    _stopwords.update(load_stopwords(stopwords_file))
+    jieba.initialize()
+    word_tokenize("warm up")
+    #langdetect is random unless seeded
+    DetectorFactory.seed = 0
+    #read-only here: new detections go back to the parent, the only writer
+    _language_cache["cache"] = LanguageCache(language_cache_file) if language_cache_file else None
+
+def route_languages(texts):
+    """
+    Language of each text from its Unicode script, or None for Latin-script (or letterless) text
+
+    Each script is one vectorized regex pass over the whole batch.
+    """
+    texts = pd.Series(texts, dtype=object)
+    langs = pd.Series(None, index=texts.index, dtype=object)
+    for lang, pattern in SCRIPT_LANGUAGES:
+        unrouted = langs.isna()
+        langs[unrouted & texts.str.contains(pattern, regex=True)] = lang
+    #no letters at all: nothing for langdetect to go on
+    langs[langs.isna() & ~texts.str.contains(LETTER, regex=True)] = 'en'
+    #pandas holds the unrouted ones as NaN
+    return [lang if isinstance(lang, str) else None for lang in langs]
+
+def detect_language(text):
+    try:
+        return detect(text)  
+    except LangDetectException:
+        return 'en'
+
+def multilingual_tokenize(text, lang):
+    if lang.startswith('zh'):
+        return jieba.lcut(text)
+    else:
+        try:
+            return word_tokenize(text, language=lang[:2])
+        except:
+            return word_tokenize(text)
+
+def clean_text(text):
+    text = re.sub(r'http\S+|@\w+|#\w+|[^\w\s]', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+def tokens(text, lang):
+    """Lower-cased tokens of one cleaned review without stopwords"""
+    words = multilingual_tokenize(text, lang)
+    words = [
+        w.lower() for w in words 
+        if w.lower() not in _stopwords 
+        and len(w) >= 2 
+        and not w.isnumeric()
+    ]
+    return " ".join(words)
+
+def process_batch(texts):
+    """
+    Preprocessed text of each review (None when nothing is left after cleaning), the langdetect
+    results that were not cached yet, and how many languages each route decided
+    """
+    cleaned = [clean_text(text) for text in texts]
+    langs = route_languages(cleaned)
+    ambiguous = {text_hash(text): text for text, lang in zip(cleaned, langs) if text and lang is None}
+    cache = _language_cache.get("cache")
+    known = cache.get_many(ambiguous) if cache else {}
+    detected = {key: detect_language(text) for key, text in ambiguous.items() if key not in known}
+    known.update(detected)
+
+    processed = []
+    routes = Counter()
+    for text, lang in zip(cleaned, langs):
+        if not text:
+            #one result per review, so results line up with the input rows
+            processed.append(None)
+            continue
+        if lang is None:
+            key = text_hash(text)
+            routes["langdetect" if key in detected else "cache"] += 1
+            lang = known[key]
+        else:
+            routes["script"] += 1
+        processed.append(tokens(text, lang))
+    return processed, detected, routes
+
+def preprocess_parallel(texts, workers=None, chunk_size=PREPROCESS_CHUNK, stopwords_file=STOPWORDS_FILE,
+                        language_cache_file=LANGUAGE_CACHE_FILE):
+    """
+    Preprocess reviews on a pool of worker processes, results in input order
+
+    Parameters:
+        texts: Review contents
+        workers: Number of processes, defaults to the number of cores
+        chunk_size: Reviews per task
+        stopwords_file: Stopword list loaded by each worker
+        language_cache_file: SQLite file of earlier langdetect results, or None to detect every ambiguous text
+    """
+    texts = list(texts)
+    workers = workers or os.cpu_count()
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    #created before the workers open it read-only
+    cache = LanguageCache(language_cache_file) if language_cache_file else None
+    processed = []
+    routes = Counter()
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(stopwords_file, language_cache_file)) as executor:
+            with tqdm(total=len(texts), desc="Preprocessing", unit="reviews") as progress:
+                #map yields in submission order whichever worker finishes first
+                for batch, detected, batch_routes in executor.map(process_batch, chunks):
+                    processed.extend(batch)
+                    routes.update(batch_routes)
+                    if cache and detected:
+                        cache.put_many(detected.items())
+                    progress.update(len(batch))
+    finally:
+        if cache:
+            cache.close()
+    seconds = time.perf_counter() - start
+    print(f"Preprocessed {len(texts):,} reviews on {workers} processes in {seconds:.1f} s "
+          f"({len(texts) / seconds if seconds else 0:,.0f} reviews/s)")
+    print(f"Languages of the reviews: {routes['script']:,} by script, {routes['cache']:,} from the cache, "
+          f"{routes['langdetect']:,} by langdetect")
+    return processed
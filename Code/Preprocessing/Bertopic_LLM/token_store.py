@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import threading
+
+from tqdm import tqdm
+
+from comment_stream import iter_comments
+from sqlite_store import AppendOnlyStore, select_in, text_hash
+
+TOKEN_STORE_DIR = os.path.join("Data","interim","LLM_result","token_store")
+#Reviews tokenized and written per step of the pre-tokenization stage
+PRETOKENIZE_CHUNK = 10000
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def tokenizer_version(tokenizer):
+    """Hash of the tokenizer's vocabulary and special tokens; token ids are only reused for the same one"""
+    vocab = json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False)
+    specials = json.dumps(tokenizer.all_special_tokens, ensure_ascii=False)
+    return hashlib.sha1((tokenizer.__class__.__name__ + vocab + specials).encode("utf-8")).hexdigest()[:16]
+
+def store_version(tokenizer, lead, suffix):
+    """Stored ids are those of lead (the whitespace before the review), the review and suffix, the end of the user message"""
+    context = hashlib.sha1((lead + "\x00" + suffix).encode('utf-8')).hexdigest()[:8]
+    return f"{tokenizer_version(tokenizer)}-{context}"
+
+class TokenStore(AppendOnlyStore):
+    def __init__(self, directory, version):
+        """
+        Token ids of reviews in an append-only int32 file, memory-mapped for reading
+
+        Reviews are keyed by the hash of their exact text: unlike verdicts, token ids change with any character.
+
+        Parameters:
+            directory: Root of the store; each tokenizer version gets its own subdirectory
+            version: tokenizer_version() of the tokenizer the ids come from
+        """
+        #review hash -> (offset, length) in ids.bin
+        super().__init__(os.path.join(directory, version), "ids.bin", "int32",
+                         ["CREATE TABLE IF NOT EXISTS reviews (text_hash TEXT PRIMARY KEY, offset INTEGER, length INTEGER)"])
+
+    def indexed_size(self):
+        return self.conn.execute("SELECT MAX(offset + length) FROM reviews").fetchone()[0] or 0
+
+    def lookup(self, keys):
+        rows = select_in(self.conn, "SELECT text_hash, offset, length FROM reviews WHERE text_hash IN ({})", keys)
+        return {key: (offset, length) for key, offset, length in rows}
+
+    def index(self, keys):
+        """(offset, length) of each stored key"""
+        with self.lock:
+            return self.lookup(keys)
+
+    def get_many(self, texts):
+        """Token ids of each text, None for texts not in the store"""
+        keys = [text_hash(text) for text in texts]
+        found = self.index(keys)
+        if not found:
+            return [None] * len(keys)
+        ids = self.mapped(max(offset + length for offset, length in found.values()))
+        return [ids[found[key][0]:found[key][0] + found[key][1]].tolist() if key in found else None for key in keys]
+
+    def lengths(self, texts):
+        """Token count of each text, None for texts not in the store, without reading the ids"""
+        keys = [text_hash(text) for text in texts]
+        found = self.index(keys)
+        return [found.get(key, (0, None))[1] for key in keys]
+
+    def put_many(self, texts, ids_list):
+        new = {}
+        for text, ids in zip(texts, ids_list):
+            new.setdefault(text_hash(text), ids)
+        with self.lock:
+            known = self.lookup(new)
+            new = {key: ids for key, ids in new.items() if key not in known}
+            if not new:
+                return
+            offset = self.write(self.np.fromiter((i for ids in new.values() for i in ids), dtype=self.np.int32))
+            rows = []
+            for key, ids in new.items():
+                rows.append((key, offset, len(ids)))
+                offset += len(ids)
+            #the index only points at ids that are already on disk
+            with self.conn:
+                self.conn.executemany("INSERT OR IGNORE INTO reviews VALUES (?, ?, ?)", rows)
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+
+def open_store(directory, version):
+    """One shared store per directory and tokenizer version, so worker threads append to the same files"""
+    with _stores_lock:
+        key = (directory, version)
+        if key not in _stores:
+            _stores[key] = TokenStore(directory, version)
+        return _stores[key]
+
+def pretokenize(review_files, model_name="Qwen/Qwen3-14B", mode="single", directory=TOKEN_STORE_DIR):
+    """Tokenize every review of review_files once for the prompt of mode, loading only the tokenizer"""
+    from transformers import AutoTokenizer
+    from llm_backends import prompt_parts
+    from prompts import PROMPTS
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    _, lead, suffix, _ = prompt_parts(tokenizer, PROMPTS[mode])
+    store = open_store(directory, store_version(tokenizer, lead, suffix))
+    for review_file in review_files:
+        chunk = []
+        for comment in tqdm(iter_comments(review_file), desc=f"Tokenizing {os.path.basename(review_file)}"):
+            chunk.append(comment["content"])
+            if len(chunk) == PRETOKENIZE_CHUNK:
+                tokenize_missing(store, tokenizer, chunk, lead, suffix)
+                chunk = []
+        tokenize_missing(store, tokenizer, chunk, lead, suffix)
+    print(f"Token store {store.directory}: {len(store)} reviews")
+
+def tokenize_missing(store, tokenizer, texts, lead, suffix):
+    missing = [text for text, length in zip(texts, store.lengths(texts)) if length is None]
+    if missing:
+        store.put_many(missing, tokenizer([lead + text + suffix for text in missing], add_special_tokens=False)["input_ids"])
+
+if __name__ == "__main__":
+    from LLM import REGIONS, LABEL_MODE
+    pretokenize([review_file for review_file, _ in REGIONS], mode=LABEL_MODE)
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import pandas as pd
+from tqdm.auto import tqdm
+
+import text_preprocessing
+from embeddings import EMBEDDING_MODEL, EmbeddingStore, load_embedding_model
+from text_preprocessing import STOPWORDS_FILE, preprocess_parallel
+
+#Every stage writes to STAGE_DIR/<stage>/<key>, the key hashing the stage's parameters and the key of the stage it reads
+STAGE_DIR = os.path.join("processing_output","stages")
+
+json_files = [
+    os.path.join("processing_data", "review_data", "china_comments.json"),
+    os.path.join("processing_data", "review_data", "usa_comments.json"),
+    os.path.join("processing_data", "review_data", "europe_comments.json")
+]
+
+UMAP_PARAMS = dict(
+    n_neighbors=50,
+    n_components=30,
+    min_dist=0.0,
+    metric='cosine',
+    low_memory=True,
+    random_state=42
+)
+
+HDBSCAN_PARAMS = dict(
+    min_cluster_size=40,
+    min_samples=20,
+    cluster_selection_epsilon=0.3,
+    cluster_selection_method='eom',
+    metric='euclidean',
+    core_dist_n_jobs=4,
+    memory='./hdbscan_cache',
+    prediction_data=True
+)
+
+VECTORIZER_PARAMS = dict(
+    stop_words=None,
+    token_pattern=r'\b[^\s]+\b',
+    max_features=10000
+)
+
+TOPIC_PARAMS = dict(
+    min_topic_size=20,
+    nr_topics='auto',
+    calculate_probabilities=False
+)
+
+#--- Data loading---
+def load_comments(json_files):
+    all_contents = []
+    for file in tqdm(json_files, desc="Loading files"):
+        with open(file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            all_contents.extend([c["content"] for c in data["comment_list"] if c["content"].strip()])
+    return pd.DataFrame(all_contents, columns=["content"])
+
+def file_fingerprint(path):
+    """Size and modification time of path; hashing every review file on each run would cost more than the stage it guards"""
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+def source_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+def stage_key(name, params, upstream=None):
+    payload = json.dumps({"stage": name, "params": params, "upstream": upstream}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+def stage_dir(name, key):
+    return os.path.join(STAGE_DIR, name, key)
+
+def run_stage(name, params, upstream, compute, save, load):
+    """
+    (key, result) of a stage, loaded from its directory when a run with the same key finished before
+
+    compute() builds the result, save(result, directory) and load(directory) persist it. The directory
+    only appears once save has returned, so an interrupted stage is recomputed on the next run.
+    """
+    key = stage_key(name, params, upstream)
+    directory = stage_dir(name, key)
+    if os.path.isdir(directory):
+        print(f"[{name}] reusing {directory}")
+        return key, load(directory)
+    print(f"[{name}] computing {key}")
+    start = time.perf_counter()
+    result = compute()
+    partial = directory + ".partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    save(result, partial)
+    with open(os.path.join(partial, "stage.json"), 'w', encoding='utf-8') as f:
+        json.dump({"stage": name, "params": params, "upstream": upstream}, f, indent=2, default=str)
+    os.replace(partial, directory)
+    print(f"[{name}] done in {time.perf_counter() - start:.1f} s -> {directory}")
+    return key, result
+
+def save_array(array, path):
+    import numpy as np
+    with open(path, 'wb') as f:
+        np.save(f, array)
+
+def load_array(path):
+    import numpy as np
+    return np.load(path)
+
+def preprocess_stage(json_files=json_files, stopwords_file=STOPWORDS_FILE):
+    """DataFrame of the non-empty comments of json_files with their "processed" text"""
+    params = {"files": [file_fingerprint(file) for file in json_files],
+              "stopwords": source_hash(stopwords_file),
+              "preprocessing": source_hash(text_preprocessing.__file__)}
+
+    def compute():
+        data = load_comments(json_files)
+        print(f"Loaded {len(data):,} comments")
+        #jieba, NLTK and langdetect run on one worker process per core
+        data["processed"] = preprocess_parallel(data["content"], stopwords_file=stopwords_file)
+        return data
+
+    return run_stage("preprocess", params, None, compute,
+                     lambda data, d: data.to_pickle(os.path.join(d, "comments.pkl")),
+                     lambda d: pd.read_pickle(os.path.join(d, "comments.pkl")))
+
+def embed_stage(texts, upstream, model_name=EMBEDDING_MODEL):
+    """float32 sentence embeddings of texts; the embedding store keeps texts already seen under other keys"""
+    def compute():
+        store = EmbeddingStore(model_name=model_name)
+        embeddings = store.embed(texts, load_embedding_model(model_name))
+        store.close()
+        return embeddings
+
+    return run_stage("embed", {"model": model_name}, upstream, compute,
+                     lambda embeddings, d: save_array(embeddings, os.path.join(d, "embeddings.npy")),
+                     lambda d: load_array(os.path.join(d, "embeddings.npy")))
+
+def reduce_stage(embeddings, upstream, umap_params=UMAP_PARAMS):
+    """(fitted UMAP model, reduced embeddings)"""
+    import joblib
+
+    def compute():
+        from umap import UMAP
+        umap_model = UMAP(**umap_params)
+        return umap_model, umap_model.fit_transform(embeddings)
+
+    def save(result, d):
+        joblib.dump(result[0], os.path.join(d, "umap.joblib"))
+        save_array(result[1], os.path.join(d, "reduced.npy"))
+
+    return run_stage("reduce", umap_params, upstream, compute, save,
+                     lambda d: (joblib.load(os.path.join(d, "umap.joblib")), load_array(os.path.join(d, "reduced.npy"))))
+
+def cluster_stage(reduced, upstream, hdbscan_params=HDBSCAN_PARAMS):
+    """(fitted HDBSCAN model, cluster label of every text (-1 for outliers), membership probability of every text)"""
+    import joblib
+
+    def compute():
+        from hdbscan import HDBSCAN
+        hdbscan_model = HDBSCAN(**hdbscan_params).fit(reduced)
+        return hdbscan_model, hdbscan_model.labels_, hdbscan_model.probabilities_
+
+    def save(result, d):
+        joblib.dump(result[0], os.path.join(d, "hdbscan.joblib"))
+        save_array(result[1], os.path.join(d, "labels.npy"))
+        save_array(result[2], os.path.join(d, "probabilities.npy"))
+
+    return run_stage("cluster", hdbscan_params, upstream, compute, save,
+                     lambda d: (joblib.load(os.path.join(d, "hdbscan.joblib")), load_array(os.path.join(d, "labels.npy")),
+                                load_array(os.path.join(d, "probabilities.npy"))))
+
+class PrecomputedReduction:
+    def __init__(self, reduced):
+        """
+        Stands in for UMAP inside BERTopic, handing over the output of the reduce stage
+
+        Parameters:
+            reduced: Reduced embeddings, one row per document being fitted
+        """
+        self.reduced = reduced
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        return self.reduced
+
+class PrecomputedClusters:
+    def __init__(self, labels, probabilities):
+        """
+        Stands in for HDBSCAN inside BERTopic, handing over the output of the cluster stage
+
+        Parameters:
+            labels: Cluster label of every document being fitted
+            probabilities: HDBSCAN membership probability of every document, the Probability column
+                of get_document_info()
+        """
+        self.labels = labels
+        self.probabilities = probabilities
+
+    def fit(self, X, y=None):
+        self.labels_ = self.labels
+        self.probabilities_ = self.probabilities
+        return self
+
+def topic_stage(texts, embeddings, reduced, labels, probabilities, upstream, umap_model, hdbscan_model,
+                vectorizer_params=VECTORIZER_PARAMS, topic_params=TOPIC_PARAMS):
+    """
+    BERTopic model fitted on the clusters of the earlier stages: c-TF-IDF, topic reduction and representations
+
+    The fitted UMAP and HDBSCAN models replace the stand-ins before saving, so the saved model
+    transforms new documents like one fitted in a single run.
+    """
+    from bertopic import BERTopic
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    embedding_model = load_embedding_model(EMBEDDING_MODEL)
+
+    def compute():
+        topic_model = BERTopic(
+            embedding_model=embedding_model,
+            umap_model=PrecomputedReduction(reduced),
+            hdbscan_model=PrecomputedClusters(labels, probabilities),
+            vectorizer_model=CountVectorizer(**vectorizer_params),
+            verbose=True,
+            **topic_params
+        )
+        topic_model.fit(texts, embeddings)
+        topic_model.umap_model = umap_model
+        topic_model.hdbscan_model = hdbscan_model
+        return topic_model
+
+    def save(topic_model, d):
+        topic_model.save(os.path.join(d, "bertopic_model"), save_embedding_model=False)
+        topic_model.get_topic_info().to_csv(os.path.join(d, "topic_info.csv"), index=False, encoding='utf-8-sig')
+
+    return run_stage("topics", {"vectorizer": vectorizer_params, "topics": topic_params}, upstream, compute, save,
+                     lambda d: BERTopic.load(os.path.join(d, "bertopic_model"), embedding_model=embedding_model))
+
+def run_pipeline(json_files=json_files, umap_params=UMAP_PARAMS, hdbscan_params=HDBSCAN_PARAMS,
+                 vectorizer_params=VECTORIZER_PARAMS, topic_params=TOPIC_PARAMS):
+    """(comments DataFrame, processed texts, fitted BERTopic model), running only the stages whose key changed"""
+    key, data = preprocess_stage(json_files)
+    texts = data["processed"].dropna().tolist()
+    key, embeddings = embed_stage(texts, key)
+    key, (umap_model, reduced) = reduce_stage(embeddings, key, umap_params)
+    key, (hdbscan_model, labels, probabilities) = cluster_stage(reduced, key, hdbscan_params)
+    _, topic_model = topic_stage(texts, embeddings, reduced, labels, probabilities, key, umap_model, hdbscan_model,
+                                 vectorizer_params, topic_params)
+    return data, texts, topic_model
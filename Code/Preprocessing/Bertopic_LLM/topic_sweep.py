@@ -0,0 +1,142 @@
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from topic_pipeline import (HDBSCAN_PARAMS, UMAP_PARAMS, VECTORIZER_PARAMS, embed_stage, json_files, preprocess_stage,
+                            reduce_stage, run_stage, stage_dir)
+
+SWEEP_FILE = os.path.join("processing_output","topic_sweep.csv")
+#Each UMAP reduction is computed once (and kept as a reduce stage) and shared by every HDBSCAN configuration
+UMAP_GRID = dict(n_neighbors=[15, 50], n_components=[5, 30])
+HDBSCAN_GRID = dict(min_cluster_size=[20, 40, 80], min_samples=[10, 20], cluster_selection_epsilon=[0.0, 0.3])
+#One core per configuration; the joblib cache of the single run is not shared between processes
+SWEEP_HDBSCAN_PARAMS = {name: value for name, value in HDBSCAN_PARAMS.items() if name != 'memory'}
+SWEEP_HDBSCAN_PARAMS.update(core_dist_n_jobs=1, prediction_data=False)
+#c-TF-IDF words per topic scored for coherence
+TOP_WORDS = 10
+
+_reduced = {}
+
+def grid(base, values):
+    """base updated with every combination of values"""
+    return [dict(base, **dict(zip(values, combo))) for combo in itertools.product(*values.values())]
+
+def terms_stage(texts, upstream, vectorizer_params=VECTORIZER_PARAMS):
+    """Document-term counts of texts with BERTopic's vectorizer settings, column-major for word lookups"""
+    import scipy.sparse as sp
+
+    def compute():
+        from sklearn.feature_extraction.text import CountVectorizer
+        return CountVectorizer(**vectorizer_params).fit_transform(texts).tocsc()
+
+    return run_stage("terms", vectorizer_params, upstream, compute,
+                     lambda terms, d: sp.save_npz(os.path.join(d, "terms.npz"), terms),
+                     lambda d: sp.load_npz(os.path.join(d, "terms.npz")).tocsc())
+
+def cluster_config(reduced_file, hdbscan_params):
+    """(labels, seconds) of one HDBSCAN configuration, run in a worker process"""
+    import numpy as np
+    from hdbscan import HDBSCAN
+
+    #memory-mapped: the workers share the page cache instead of each holding a copy
+    if reduced_file not in _reduced:
+        _reduced[reduced_file] = np.load(reduced_file, mmap_mode='r')
+    start = time.perf_counter()
+    labels = HDBSCAN(**hdbscan_params).fit(_reduced[reduced_file]).labels_
+    return labels, time.perf_counter() - start
+
+def topic_words(terms, labels, top_n=TOP_WORDS):
+    """Column indices of the top_n c-TF-IDF words of each cluster, outliers left out, as BERTopic weighs them"""
+    import numpy as np
+    import scipy.sparse as sp
+
+    keep = np.flatnonzero(labels >= 0)
+    if not len(keep):
+        return []
+    topics, rows = np.unique(labels[keep], return_inverse=True)
+    membership = sp.csr_matrix((np.ones(len(keep)), (rows, keep)), shape=(len(topics), len(labels)))
+    counts = (membership @ terms).toarray()
+    tf = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+    idf = np.log(1 + counts.sum(axis=1).mean() / np.maximum(counts.sum(axis=0), 1))
+    words = []
+    for topic_counts, weights in zip(counts, tf * idf):
+        top = weights.argsort()[::-1][:top_n]
+        words.append(top[topic_counts[top] > 0])
+    return words
+
+def npmi_coherence(present, words):
+    """NPMI of the word pairs of each topic over document co-occurrence, averaged per topic, then over topics"""
+    import numpy as np
+
+    n = present.shape[0]
+    scores = []
+    for topic in words:
+        if len(topic) < 2:
+            continue
+        sub = present[:, topic]
+        joint = (sub.T @ sub).toarray() / n
+        i, j = np.triu_indices(len(topic), 1)
+        p_i, p_j, p_ij = joint[i, i], joint[j, j], joint[i, j]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            npmi = np.log(p_ij / (p_i * p_j)) / -np.log(p_ij)
+        #never together: -1; always together: 1
+        npmi = np.where(p_ij == 0, -1.0, np.where(p_ij == 1, 1.0, npmi))
+        scores.append(npmi.mean())
+    return float(np.mean(scores)) if scores else float('nan')
+
+def sweep(json_files=json_files, umap_grid=UMAP_GRID, hdbscan_grid=HDBSCAN_GRID, workers=None, sweep_file=SWEEP_FILE):
+    """
+    Topic count, outlier ratio, NPMI coherence and HDBSCAN wall time of every UMAP x HDBSCAN configuration
+
+    Parameters:
+        json_files: Review files, preprocessed and embedded once through the stages of topic_pipeline.py
+        umap_grid: UMAP parameter values to combine, on top of UMAP_PARAMS
+        hdbscan_grid: HDBSCAN parameter values to combine, on top of SWEEP_HDBSCAN_PARAMS
+        workers: Number of HDBSCAN processes, defaults to the number of cores
+        sweep_file: CSV the table is written to
+    """
+    import numpy as np
+
+    preprocess_key, data = preprocess_stage(json_files)
+    texts = data["processed"].dropna().tolist()
+    embed_key, embeddings = embed_stage(texts, preprocess_key)
+    _, terms = terms_stage(texts, preprocess_key)
+    present = (terms > 0).astype(np.float32).tocsc()
+
+    configs = []
+    for umap_params in grid(UMAP_PARAMS, umap_grid):
+        reduce_key, _ = reduce_stage(embeddings, embed_key, umap_params)
+        reduced_file = os.path.join(stage_dir("reduce", reduce_key), "reduced.npy")
+        configs.extend((umap_params, reduced_file, hdbscan_params)
+                       for hdbscan_params in grid(SWEEP_HDBSCAN_PARAMS, hdbscan_grid))
+
+    workers = workers or os.cpu_count()
+    print(f"Sweeping {len(configs)} configurations on {workers} processes")
+    rows = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as executor:
+        #results come back in configuration order; coherence is scored here while the workers cluster
+        results = executor.map(cluster_config, [c[1] for c in configs], [c[2] for c in configs])
+        for (umap_params, _, hdbscan_params), (labels, seconds) in zip(configs, results):
+            row = {name: umap_params[name] for name in umap_grid}
+            row.update((name, hdbscan_params[name]) for name in hdbscan_grid)
+            row.update(topics=len(set(labels) - {-1}), outlier_ratio=round(float(np.mean(labels == -1)), 4),
+                       coherence=round(npmi_coherence(present, topic_words(terms, labels)), 4),
+                       seconds=round(seconds, 1))
+            print(row)
+            rows.append(row)
+    print(f"Sweep done in {time.perf_counter() - start:.1f} s")
+
+    table = pd.DataFrame(rows)
+    os.makedirs(os.path.dirname(sweep_file), exist_ok=True)
+    table.to_csv(sweep_file, index=False)
+    print(table.to_string(index=False))
+    return table
+
+if __name__ == "__main__":
+    #python topic_sweep.py [workers]
+    sweep(workers=int(sys.argv[1]) if len(sys.argv) > 1 else None)
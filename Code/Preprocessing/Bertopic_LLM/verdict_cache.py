@@ -0,0 +1,88 @@
+import sqlite3
+import json
+import re
+import unicodedata
+
+from sqlite_store import select_in, text_hash
+
+#Trailing/leading punctuation that does not change a verdict ("Great!" == "great")
+STRIP_CHARS = " .!?,;:~-…。！？，、；："
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(STRIP_CHARS)
+
+class VerdictCache:
+    def __init__(self, db_path, prompt_version):
+        """
+        Persistent LLM verdicts keyed by normalized review text and prompt version
+
+        Parameters:
+            db_path: Path to the SQLite file (created if missing)
+            prompt_version: Identifier of the prompt; changing it invalidates earlier verdicts
+        """
+        self.prompt_version = prompt_version
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "text_hash TEXT, prompt_version TEXT, sentiment TEXT, "
+            "PRIMARY KEY (text_hash, prompt_version))"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(verdicts)")]
+        if "confidence" not in columns:
+            self.conn.execute("ALTER TABLE verdicts ADD COLUMN confidence TEXT")
+        self.hits = 0
+        self.misses = 0
+        self.inference_seconds = 0.0
+
+    def key(self, text):
+        return text_hash(normalize_text(text))
+
+    def get_many(self, keys):
+        """(sentiment, confidence) per cached key"""
+        rows = select_in(
+            self.conn,
+            "SELECT text_hash, sentiment, confidence FROM verdicts WHERE prompt_version = ? AND text_hash IN ({})",
+            keys, [self.prompt_version]
+        )
+        return {key: (sentiment, json.loads(confidence) if confidence else None) for key, sentiment, confidence in rows}
+
+    def put_many(self, items):
+        """items: (key, (sentiment, confidence)) pairs"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO verdicts (text_hash, prompt_version, sentiment, confidence) VALUES (?, ?, ?, ?)",
+                [(key, self.prompt_version, sentiment, json.dumps(confidence) if confidence else None)
+                 for key, (sentiment, confidence) in items]
+            )
+
+    def record(self, hits, misses, inference_seconds):
+        self.hits += hits
+        self.misses += misses
+        self.inference_seconds += inference_seconds
+        if misses:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('seconds_per_review', ?)",
+                    (inference_seconds / misses,)
+                )
+
+    def seconds_per_review(self):
+        if self.misses:
+            return self.inference_seconds / self.misses
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'seconds_per_review'").fetchone()
+        return row[0] if row else None
+
+    def report(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        per_review = self.seconds_per_review()
+        saved = f"{self.hits * per_review:.1f}" if per_review is not None else "n/a"
+        return (f"Verdict cache: {self.hits}/{total} hits ({hit_rate:.1%}), "
+                f"inference {self.inference_seconds:.1f} s, GPU-seconds saved {saved}")
+
+    def close(self):
+        self.conn.close()
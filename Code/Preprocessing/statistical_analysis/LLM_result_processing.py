@@ -1,10 +1,21 @@
 import json
 import os
+import hashlib
 from glob import glob
 from tqdm import tqdm
 import re
 import csv
 
+# Map category number to field name
+category_map = {
+    '1': "Charging Functionality and Reliability",
+    '2': "Charging Performance",
+    '3': "Location and Availability",
+    '4': "Pricing and Payment",
+    '5': "Environment and Service Experience",
+    '9': "Other"
+}
+
 def transform_sentiment(sentiment_str):
     if not sentiment_str:
         return None
@@ -30,19 +41,12 @@ def transform_sentiment(sentiment_str):
         overall_sentiment = "Positive"
     elif overall_sentiment_num == '8' or overall_sentiment_num == 'Neutral':
         overall_sentiment = "Neutral"
+    else:
+        return None
 
     
-    # Map category number to field name
-    category_map = {
-        '1': "Charging Functionality and Reliability",
-        '2': "Charging Performance",
-        '3': "Location and Availability",
-        '4': "Pricing and Payment",
-        '5': "Environment and Service Experience",
-        '9': "Other"
-    }
-    
     category = category_map.get(category_num, "Other")
+    sentiment_map = {'6': "Negative", '7': "Positive", '8': "Neutral", '0': "null"}
     
     sentiment_analysis = {
         "Charging Functionality and Reliability": "null",
@@ -53,7 +57,11 @@ def transform_sentiment(sentiment_str):
         "Overall sentiment": overall_sentiment
     }
     
-    if category_num != '9':
+    # Aspects mode: one sentiment digit per category 1-5, 0 when the review does not mention it
+    if re.fullmatch(r"[0678]{5}", category_num):
+        for digit, name in zip(category_num, list(category_map.values())[:5]):
+            sentiment_analysis[name] = sentiment_map[digit]
+    elif category_num != '9':
         sentiment_analysis[category] = overall_sentiment
     
     return {
@@ -61,6 +69,27 @@ def transform_sentiment(sentiment_str):
         "keywords": keywords if keywords else "null"
     }
 
+def label_problem(sentiment_str):
+    """Why a labelling response cannot be used as is, or None when it can"""
+    if transform_sentiment(sentiment_str) is None:
+        return "unparseable" if len(sentiment_str.split(',')) < 2 else "sentiment out of range"
+    category_num = sentiment_str.split(',')[1].strip()
+    if category_num not in category_map and not re.fullmatch(r"[0678]{5}", category_num):
+        return "category out of range"
+    return None
+
+def relabel_entry(json_file, comment, problem):
+    # Same key as comment_key in LLM.py, so the labelling run can find the review again
+    content_hash = hashlib.sha1(comment["content"].encode("utf-8")).hexdigest()
+    return {
+        "file": json_file,
+        "key": f"{comment['uid']}:{content_hash}",
+        "uid": comment["uid"],
+        "content_hash": content_hash,
+        "response": comment["sentiment"],
+        "problem": problem
+    }
+
 def transform_comment(comment):
     transformed = {
         "content": comment["content"],
@@ -84,11 +113,16 @@ def transform_comment(comment):
             "Overall sentiment": "null"
         }
         transformed["keywords"] = "null"
+
+    #probabilities of the sentiment and category tokens, when the labelling run recorded them
+    if comment.get("confidence"):
+        transformed["confidence"] = comment["confidence"]
     
     return transformed
 
 def process_files(input_folder, output_file):
     merged_data = {"comment_list": []}
+    relabel = []
     
     json_files = glob(os.path.join(input_folder, "*.json"))
     
@@ -101,11 +135,22 @@ def process_files(input_folder, output_file):
                     continue
                 transformed_comment = transform_comment(comment)
                 merged_data["comment_list"].append(transformed_comment)
+                # Responses that exist but cannot be used go to the re-label manifest
+                problem = label_problem(comment["sentiment"]) if comment.get("sentiment") else None
+                if problem:
+                    relabel.append(relabel_entry(json_file, comment, problem))
     
 
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(merged_data, f, ensure_ascii=False, indent=2)
 
+    # Re-label with: python LLM.py --relabel <manifest>
+    manifest_file = os.path.splitext(output_file)[0] + ".relabel.jsonl"
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        for entry in relabel:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    print(f"{len(relabel)} unusable responses written to {manifest_file}")
+
 input_folder = "Data\\interim\\LLM_result\\europe"
 output_file = "Data\\interim\\LLM_result_processing\\europe_comments.json"
 process_files(input_folder, output_file)